@@ -1,11 +1,13 @@
 import numpy as np
 import torch 
 import time
+import itertools
 from copy import deepcopy
 
 from models import GPR
 from graph_utils import get_heading
-from utils import entropy_from_cov, compute_mae, predictive_distribution, find_shortest_path, find_equi_sample_path
+from gp_utils import GPPosterior, KernelCache, IncrementalEntropy, IncrementalMutualInformation, PathGain, parallel_set_gains, standard_greedy, lazy_greedy, stochastic_greedy
+from utils import SampleStore, fused_noise_variance, compute_mae, find_shortest_path, find_equi_sample_path, top_k
 import ipdb
 
 
@@ -20,6 +22,13 @@ class Agent(object):
         self.mobile_std = 10*self.static_std if mobile_std is None else mobile_std
         self.num_samples_per_batch = args.num_samples_per_batch
         self.update_every = args.update_every
+        self.greedy_mode = args.greedy
+        self.stochastic_epsilon = args.stochastic_epsilon
+        self.num_workers = args.num_workers
+        self.beam_width = args.beam_width
+        self.num_rollouts = args.num_rollouts
+        if args.precompute_distances:
+            self.env.map.precompute_distances(args.distance_table)
         
         self.reset()
         if parent_agent is None:
@@ -27,18 +36,22 @@ class Agent(object):
             self._pre_train(num_samples=num_pretrain)
         else:
             self.load_model(parent_agent)
-            self.static_data = deepcopy(parent_agent.static_data)
-            self.mobile_data = deepcopy(parent_agent.mobile_data)
+            self.samples = parent_agent.samples.clone()
             self.collected = deepcopy(parent_agent.collected)
             
     def _init_model(self, args):
         kernel_params = {'type': args.kernel}
         self.gp = GPR(latent=args.latent, lr=args.lr, max_iterations=args.max_iterations, kernel_params=kernel_params,
-                      learn_likelihood_noise=self.learn_likelihood_noise)
+                      learn_likelihood_noise=self.learn_likelihood_noise, optimizer=args.optimizer, tol=args.fit_tol,
+                      patience=args.fit_patience, warm_start=not args.cold_start)
+        # field locations followed by test locations
+        self.kernel = KernelCache(self.gp, np.concatenate([self.env.X, self.env.test_X], axis=0))
+        self.posterior = GPPosterior(self.kernel)
 
     def load_model(self, parent_agent):
         self.gp.reset(parent_agent.gp.train_x, parent_agent.gp.train_y, parent_agent.gp.train_var)
-        self.gp.model.load_state_dict(parent_agent.gp.model.state_dict())
+        self.gp.load_state_dict(parent_agent.gp.model.state_dict())
+        self.posterior.reset()
         
     def save_model(self, filename):
         state = {'state_dict': self.gp.model.state_dict()}
@@ -50,8 +63,7 @@ class Agent(object):
         self.path = np.copy(self.pose).reshape(-1, 2)
         self.collected = {'ind': [], 'std': [], 'y': []}
         self.static_locations = np.empty((0, 2))
-        self.static_data = [[] for _ in range(self.env.num_samples)]
-        self.mobile_data = [[] for _ in range(self.env.num_samples)]
+        self.samples = SampleStore(self.env.num_samples)
         
     def _pre_train(self, num_samples):
         print('====================================================')
@@ -69,12 +81,10 @@ class Agent(object):
             idx = indices[i]
             if idx == -1:
                 continue
-            y = self.env.collect_samples(idx, stds[i])
-            all_y[i] = y
-            if stds[i] == self.static_std:
-                self.static_data[idx].append(y)
-            else:
-                self.mobile_data[idx].append(y)
+            all_y[i] = self.env.collect_samples(idx, stds[i])
+
+        valid = [i for i in range(len(indices)) if indices[i] != -1]
+        self.samples.add([indices[i] for i in valid], [all_y[i] for i in valid], [stds[i] == self.static_std for i in valid])
 
         # update collected
         self.collected['ind'] += list(indices)
@@ -85,36 +95,13 @@ class Agent(object):
         indices, y, var = self.get_sampled_dataset()        
         x = self.env.X[indices]
         self.gp.fit(x, y, var)
+        self.posterior.reset()
         
     def _post_update(self):
-        self.cov_matrix = self.gp.cov_mat(x1=self.env.X, add_likelihood_var=True)
+        self.cov_matrix = self.kernel(np.arange(self.env.num_samples), add_likelihood_var=True)
         
     def get_sampled_dataset(self):
-        all_y = []
-        all_var = []
-        indices = []
-        for i in range(self.env.num_samples):
-            if len(self.mobile_data[i])>0 and len(self.static_data[i])>0:
-                yc = np.mean(self.mobile_data[i])
-                ys = np.mean(self.static_data[i])
-                yeq = (self.mobile_std**2 * ys + self.static_std**2 * yc) / (self.mobile_std**2 + self.static_std**2)
-                var = 1 / (1/(self.static_std**2) + 1/(self.mobile_std**2))
-
-            elif len(self.static_data[i])>0:
-                yeq = np.mean(self.static_data[i])
-                var = self.static_std**2
-
-            elif len(self.mobile_data[i])>0:
-                yeq = np.mean(self.mobile_data[i])
-                var = self.mobile_std**2
-
-            else:
-                continue
-            all_y.append(yeq)
-            all_var.append(var)
-            indices.append(i)
-
-        return indices, np.array(all_y), np.array(all_var)
+        return self.samples.get_dataset(self.static_std, self.mobile_std)
 
     def _setup_ipp(self, criterion, update=False):
         self.criterion = criterion
@@ -122,10 +109,24 @@ class Agent(object):
         #     self.reset()
         self._post_update()
 
-    def run_ipp(self, render=False, num_runs=10, criterion='entropy', update=False, slack=0, strategy='MaxEnt', disp=True):
+    def run_ipp(self, render=False, num_runs=10, criterion='entropy', update=False, slack=0, strategy='MaxEnt', disp=True, planning_budget=None,
+                branch_and_bound=False, stream_paths=False):
         # informative path planner
-        assert strategy in ['MaxEnt', 'Shortest', 'Equi-Sample'], 'Unknown strategy!!'
+        # planning_budget is the time (in seconds) allowed for finding paths in each run (None for exhaustive search)
+        # with branch_and_bound, the most informative path is found without enumerating all the paths (MaxEnt and entropy only)
+        # with stream_paths, paths are generated one at a time and only the selected ones are kept (MaxEnt and Shortest)
+        # Beam and Rollout plan a single path with a beam search (self.beam_width) or monte carlo rollouts
+        # (self.num_rollouts) instead of enumerating all the paths, their budget is the cost of the default policy path
+        # (an upper bound of the least cost) + slack, so their paths can be longer than the least cost + slack
+        assert strategy in ['MaxEnt', 'Shortest', 'Equi-Sample', 'Beam', 'Rollout'], 'Unknown strategy!!'
+        assert not branch_and_bound or strategy == 'MaxEnt', 'Branch and bound is only used with MaxEnt!!'
+        # its bound on the gain of the rest of a path relies on submodularity, which holds for entropy but not for mutual information
+        assert not branch_and_bound or criterion == 'entropy', 'Branch and bound is only used with entropy!!'
+        assert not stream_paths or strategy in ['MaxEnt', 'Shortest'], 'Streaming is only used with MaxEnt and Shortest!!'
+        assert not (branch_and_bound and stream_paths), 'Use either branch and bound or streaming!!'
         assert criterion in ['entropy', 'mutual_information'], 'Unknown criterion!!'
+        assert self.greedy_mode in ['standard', 'lazy', 'stochastic'], 'Unknown greedy mode!!'
+        assert self.greedy_mode != 'lazy' or criterion == 'entropy', 'Lazy greedy is only used with entropy!!'
         self._setup_ipp(criterion, update)
 
         test_error = []
@@ -150,19 +151,60 @@ class Agent(object):
             
             # find all paths 
             start = time.time()
-            least_cost_ub = self.env.get_heuristic_cost(self.pose, self.heading, waypoints)
-            if disp:
-                print('Least cost upper bound:',least_cost_ub)
-            paths_checkpoints, paths_indices, paths_cost = self.env.get_all_paths(self.pose, self.heading, waypoints, least_cost_ub, slack)
+            if branch_and_bound or stream_paths:
+                # the planning budget covers the heuristic cost and the search
+                # (get_all_paths computes it only when the paths aren't cached, Beam and Rollout bound the cost with
+                # their default policy path instead)
+                deadline = None if planning_budget is None else start + planning_budget
+                least_cost_ub = self.env.get_heuristic_cost(self.pose, self.heading, waypoints, deadline=deadline)
+                search_budget = None if deadline is None else max(0, deadline - time.time())
+                if disp:
+                    print('Least cost upper bound:',least_cost_ub)
+            if strategy in ['Beam', 'Rollout']:
+                path_score = self._path_scorer(new_gp_indices, self.num_workers)
+                if strategy == 'Beam':
+                    path = self.env.get_beam_path(self.pose, self.heading, waypoints, path_score, None, slack, width=self.beam_width,
+                                                  time_budget=planning_budget)
+                else:
+                    path = self.env.get_rollout_path(self.pose, self.heading, waypoints, path_score, None, slack,
+                                                     num_rollouts=self.num_rollouts, time_budget=planning_budget)
+                paths_checkpoints, paths_indices, paths_cost, paths_gain = [[x] for x in path]
+            elif branch_and_bound:
+                path_gain = PathGain(*self._path_engine(new_gp_indices))
+                paths_checkpoints, paths_indices, paths_cost, paths_gain, exhaustive = self.env.get_best_paths(self.pose, self.heading, waypoints, path_gain,
+                                                                                                              least_cost_ub, slack, time_budget=search_budget,
+                                                                                                              return_exhaustive=True)
+            elif stream_paths:
+                paths = self.env.iter_paths(self.pose, self.heading, waypoints, least_cost_ub, slack, time_budget=search_budget)
+                if strategy == 'Shortest':
+                    # paths are generated in increasing order of cost, so only the least cost paths are generated
+                    first = next(paths)
+                    paths = [first] + list(itertools.takewhile(lambda p: p[2] == first[2], paths))
+                else:
+                    paths = [record for _, record in self.top_paths(paths, new_gp_indices)]
+                paths_checkpoints, paths_indices, paths_cost = [list(x) for x in zip(*paths)]
+            else:
+                paths_checkpoints, paths_indices, paths_cost, exhaustive = self.env.get_all_paths(self.pose, self.heading, waypoints, None, slack,
+                                                                                                  time_budget=planning_budget, return_exhaustive=True)
             end = time.time()
             if disp:
-                print('Number of feasible paths: ', len(paths_indices))
+                if strategy in ['Beam', 'Rollout']:
+                    print('Path gain: {:.4f}'.format(paths_gain[0]))
+                elif branch_and_bound:
+                    print('Best path gain: {:.4f}'.format(paths_gain[0]), '' if exhaustive else '(planning budget exhausted)')
+                elif stream_paths:
+                    print('Number of paths kept: ', len(paths_indices))
+                else:
+                    print('Number of feasible paths: ', len(paths_indices), '' if exhaustive else '(planning budget exhausted)')
+                    print('Path cache:', self.env.path_cache.info())
                 print('Time consumed {:.4f}'.format(end - start))
                 print('\n------ Finding best path ----------')
             
             # find optimal path
             start = time.time()
-            if strategy == 'Shortest':
+            if branch_and_bound or strategy in ['Beam', 'Rollout'] or (stream_paths and strategy == 'MaxEnt'):
+                best_idx = 0
+            elif strategy == 'Shortest':
                 best_idx = find_shortest_path(paths_cost)
             else:
                 best_idx = self.best_path(paths_indices, new_gp_indices)
@@ -229,6 +271,7 @@ class Agent(object):
         return results
 
     def run_greedy_ipp(self, num_runs=10, criterion='entropy', strategy='MaxEnt', disp=True):
+        assert self.greedy_mode != 'lazy' or criterion == 'entropy', 'Lazy greedy is only used with entropy!!'
         self._setup_ipp(criterion)
         
         for i in range(num_runs):
@@ -286,74 +329,54 @@ class Agent(object):
         print('Test ERROR: {:.4f}'.format(error))
         print('Predictive Variance Max: {:.3f} Min: {:.3f} Mean: {:.3f}'.format(var.max(), var.min(), var.mean()))
 
+    def _test_indices(self):
+        # test locations follow the field locations in the kernel cache
+        return self.env.num_samples + np.arange(len(self.env.test_X))
+
     def predict(self, x=None, return_var=False, return_cov=False, return_mi=False):
-        x = self.env.test_X if x is None else x
+        x = self._test_indices() if x is None else x
         train_ind, train_y, train_var = self.get_sampled_dataset()
-        train_x = self.env.X[train_ind]
-        return predictive_distribution(self.gp, train_x, train_y, x, train_var, return_var=return_var, return_cov=return_cov, return_mi=return_mi)
+        # only the newly sampled locations (or locations with new measurements) update the factor
+        self.posterior.update(train_ind, train_ind, train_y, train_var)
+        return self.posterior.predict(x, return_var=return_var, return_cov=return_cov, return_mi=return_mi)
+
+    def _noise_variance(self, static_sampled, mobile_sampled):
+        # variance of the fused measurement at every location (np.inf if the location hasn't been sampled)
+        return fused_noise_variance(static_sampled, mobile_sampled, self.static_std, self.mobile_std)
 
     def greedy(self, num_samples):
         # select most informative samples in a greedy manner
-        n = self.env.num_samples
-        mobile_sampled = np.array([False if len(x)==0 else True for x in self.mobile_data])
-        mobile_var = np.full(n, np.inf)
-        mobile_var[mobile_sampled] = self.mobile_std**2
-        
-        static_sampled = np.array([False if len(x)==0 else True for x in self.static_data])
-        static_var = np.full(n, np.inf)
-        static_var[static_sampled] = self.static_std**2
-        
-        sampled = static_sampled | mobile_sampled
-        var = 1.0 / (1.0/static_var[sampled] + 1.0/mobile_var[sampled])
-        cov_v = self.cov_matrix[sampled].T[sampled].T + np.diag(var)
-        ent_v = entropy_from_cov(cov_v)
-
-        cumm_utilities = []
-        new_samples = []
-        for _ in range(num_samples):
-            utilities = np.full(n, -np.inf)
-            cond = ent_v + sum(cumm_utilities)
-
-            for i in range(n):
-                if static_sampled[i]:
-                    continue
-
-                # modify sampled (temporarily)
-                static_sampled[i] = True
-                static_var[i] = self.static_std**2
-                sampled = static_sampled | mobile_sampled
-                var = 1.0 / (1.0/static_var[sampled] + 1.0/mobile_var[sampled])
-        
-                # a - set of all sampled locations 
-                cov_a = self.cov_matrix[sampled].T[sampled].T + np.diag(var)
-                ent_a = entropy_from_cov(cov_a)
-                if self.criterion == 'mutual_information':
-                    cov_abar = self.cov_matrix[~sampled].T[~sampled].T 
-                    ent_abar = entropy_from_cov(cov_abar)
-                    
-                    precision = 1.0/static_var + 1.0/mobile_var
-                    precision[precision==0] = np.inf
-                    var = 1.0 / precision
-                    cov_all = self.cov_matrix + np.diag(var)
-                    ent_all = entropy_from_cov(cov_all)
-                    ut = ent_a + ent_abar - ent_all
-                else:
-                    ut = ent_a - cond
-
-                utilities[i] = ut
-
-                # reset sampled
-                static_sampled[i] = False
-                static_var[i] = np.inf
+        mobile_sampled = self.samples.mobile_sampled
+        static_sampled = self.samples.static_sampled
+        noise_var = self._noise_variance(static_sampled, mobile_sampled)
+        if self.criterion == 'mutual_information':
+            engine = IncrementalMutualInformation(self.cov_matrix, noise_var)
+        else:
+            engine = IncrementalEntropy(self.cov_matrix, noise_var)
+
+        # utility of a candidate is the gain in entropy (or mutual information) of the sampled locations
+        candidates = np.where(~static_sampled)[0]
+        var = self._noise_variance(np.full(len(candidates), True), mobile_sampled[candidates])
+        if self.greedy_mode == 'lazy':
+            return lazy_greedy(engine, candidates, var, num_samples)
+        elif self.greedy_mode == 'stochastic':
+            return stochastic_greedy(engine, candidates, var, num_samples, self.stochastic_epsilon)
+        return standard_greedy(engine, candidates, var, num_samples)
+
+    def _path_engine(self, static_indices):
+        # engine of the static and already sampled locations (factorized once and shared by all the paths)
+        # and the noise variance at every location after a mobile sample along a path
+        mobile_sampled = self.samples.mobile_sampled
+        static_sampled = self.samples.static_sampled
+        static_sampled[static_indices] = True
 
-            best_sample = np.argmax(utilities)
-            cumm_utilities.append(utilities[best_sample])
-            new_samples.append(best_sample)
-            # update sampled
-            static_sampled[best_sample] = True
-            static_var[best_sample] = self.static_std**2
- 
-        return new_samples
+        noise_var = self._noise_variance(static_sampled, mobile_sampled)
+        if self.criterion == 'mutual_information':
+            engine = IncrementalMutualInformation(self.cov_matrix, noise_var)
+        else:
+            engine = IncrementalEntropy(self.cov_matrix, noise_var)
+        path_var = self._noise_variance(static_sampled, np.full(len(static_sampled), True))
+        return engine, path_var
 
     def best_path(self, paths_mobile_indices, static_indices):
         # paths_indices contains mobile sensing indices on the path
@@ -362,46 +385,38 @@ class Agent(object):
         if len(paths_mobile_indices) == 1:
             return 0
 
-        n = self.env.num_samples
-        org_mobile_sampled = np.array([False if len(x)==0 else True for x in self.mobile_data])
-        
-        static_sampled = np.array([False if len(x)==0 else True for x in self.static_data])
-        static_sampled[static_indices] = True
-        static_var = np.full(n, np.inf)
-        static_var[static_sampled] = self.static_std**2
-        
-        all_ut = []
-        for i in range(len(paths_mobile_indices)):
-            mobile_sampled = np.copy(org_mobile_sampled)
-            mobile_indices = paths_mobile_indices[i]
-            mobile_sampled[mobile_indices] = True
-            
-            mobile_var = np.full(n, np.inf)
-            mobile_var[mobile_sampled] = self.mobile_std**2
-        
-            sampled = static_sampled | mobile_sampled
-            var = 1.0 / (1.0/static_var[sampled] + 1.0/mobile_var[sampled])
-        
-            # a - set of all sampled locations 
-            cov_a = self.cov_matrix[sampled].T[sampled].T + np.diag(var)
-            ent_a = entropy_from_cov(cov_a)
-            if self.criterion == 'mutual_information':
-                cov_abar = self.cov_matrix[~sampled].T[~sampled].T 
-                ent_abar = entropy_from_cov(cov_abar)
-                
-                precision = 1.0/static_var + 1.0/mobile_var
-                precision[precision==0] = np.inf
-                var = 1.0 / precision
-                cov_all = self.cov_matrix + np.diag(var)
-                ent_all = entropy_from_cov(cov_all)
-                ut = ent_a + ent_abar - ent_all
-            else:
-                ut = ent_a
-            all_ut.append(ut)
+        engine, path_var = self._path_engine(static_indices)
+
+        # each path is scored by the joint gain of its additional mobile samples
+        paths_indices = [np.unique(x).astype(int) for x in paths_mobile_indices]
+        paths_var = [path_var[x] for x in paths_indices]
+        if self.num_workers > 1:
+            all_ut = parallel_set_gains(engine, paths_indices, paths_var, self.num_workers)
+        else:
+            all_ut = engine.set_gains(paths_indices, paths_var)
 
         idx = np.argmax(all_ut)
         return idx
 
+    def _path_scorer(self, static_indices, num_workers=1):
+        # function mapping a list of mobile indices of paths to the gains of the paths
+        engine, path_var = self._path_engine(static_indices)
+
+        def score(paths_mobile_indices):
+            paths_indices = [np.unique(x).astype(int) for x in paths_mobile_indices]
+            paths_var = [path_var[x] for x in paths_indices]
+            if num_workers > 1:
+                return parallel_set_gains(engine, paths_indices, paths_var, num_workers)
+            return engine.set_gains(paths_indices, paths_var)
+
+        return score
+
+    def top_paths(self, paths, static_indices, k=1, batch_size=1024):
+        # (gain, record) of the k most informative (checkpoints, mobile indices, cost) records generated by paths
+        # (e.g. env.iter_paths), paths are scored in batches so only k + batch_size of them are held in memory
+        score = self._path_scorer(static_indices, self.num_workers)
+        return top_k(paths, k, lambda batch: score([x[1] for x in batch]), batch_size)
+
     def run_naive(self, std, counts, metric='distance'):
         # traverse each row from start to end in a naive manner
         # counts should be list of ints
@@ -419,7 +434,7 @@ class Agent(object):
                 # keep moving in the heading direction till you reach the end and need to shift to the next array
                 next_pose = (self.pose[0]+self.heading[0], self.pose[1]+self.heading[1])
                 ind = self.env.map_pose_to_gp_index_matrix[next_pose]
-                if ind is not None:
+                if ind >= 0:
                     inds.append(ind)
 
                 if metric == 'samples':
@@ -473,14 +488,14 @@ class Agent(object):
         return results
 
     def get_samples_sequence_from_path(self, path, waypoints):
-        indices = []
         std = []
         sampled = [False]*len(waypoints)
-        for loc in path:
+        path = np.asarray(path)
+        # -1 for locations without a sample
+        indices = list(self.env.map_pose_to_gp_index_matrix[path[:, 0], path[:, 1]])
+        for loc, gp_index in zip(path, indices):
             loc = tuple(loc)
-            gp_index = self.env.map_pose_to_gp_index_matrix[loc]
-            indices.append(gp_index if gp_index is not None else -1)
-            if gp_index is not None:
+            if gp_index >= 0:
                 if loc in waypoints:
                     idx = waypoints.index(loc)
                     if not sampled[idx]:
@@ -495,24 +510,24 @@ class Agent(object):
         return indices, std
 
     def prediction_vs_distance(self, test_every, num_runs):
-        count = 0
+        # prefixes of the collected samples are nested, so a single posterior is grown in one pass
+        # and evaluated at every test_every boundary
+        posterior = GPPosterior(self.kernel)
+        inds = np.array(self.collected['ind'])
+        var = np.array(self.collected['std'])**2
+        y = np.array(self.collected['y'])
         all_error = []
         all_mi = []
         all_var = []
 
-        while count < test_every*num_runs:
-            count += test_every
-            inds = np.array(self.collected['ind'][:count])
-            valid = inds!=-1
-
-            x = self.env.X[inds[valid]]
-            var = np.array(self.collected['std'])[:count][valid]**2
-            y = np.array(self.collected['y'])[:count][valid]
-            mu, cov, mi = predictive_distribution(self.gp, x, y, self.env.test_X, var, return_mi=True, return_cov=True)            
+        for count in range(test_every, test_every*num_runs + 1, test_every):
+            valid = np.where(inds[:count]!=-1)[0]
+            posterior.update(valid, inds[valid], y[valid], var[valid])
+            mu, cov, mi = posterior.predict(self._test_indices(), return_mi=True, return_cov=True)
 
             error = compute_mae(self.env.test_Y, mu)
             all_error.append(error)
             all_mi.append(mi)
             all_var.append(np.diag(cov).mean())
         results = {'mean': mu, 'error': all_error, 'mi': all_mi, 'mean_var': all_var}
-        return results
\ No newline at end of file
+        return results
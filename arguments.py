@@ -10,6 +10,10 @@ def get_args():
     # gp model 
     parser.add_argument('--lr', default=.1, type=float, help='learning rate of GP model')
     parser.add_argument('--max_iterations', default=200, type=int, help='number of training iterations for GP model')
+    parser.add_argument('--optimizer', default='adam', help='optimizer for GP hyperparameters {adam, lbfgs}')
+    parser.add_argument('--fit_tol', default=1e-4, type=float, help='stop fitting when relative improvement of log likelihood is below this')
+    parser.add_argument('--fit_patience', default=10, type=int, help='number of iterations without improvement before stopping')
+    parser.add_argument('--cold_start', action='store_true', help='refit GP hyperparameters from scratch instead of the previous fit')
     parser.add_argument('--data_file', default=None, help='pickle file to load data from')
     parser.add_argument('--phenotype', default='plant_height', help='target feature')
     parser.add_argument('--kernel', default='matern', help='kernel of GP model {rbf, matern}')
@@ -20,12 +24,24 @@ def get_args():
     parser.add_argument('--num_runs', default=6, type=int, help='number of batches')
     parser.add_argument('--fraction_pretrain', default=.75, type=float, help='fraction of all training data used for learning hyperparameters')
     parser.add_argument('--num_samples_per_batch', default=4, type=int, help='number of static samples collected in each batch')
-    parser.add_argument('--slack', default=0, type=int, help='budget = shortest path length + slack')
+    parser.add_argument('--slack', default=0, type=int, help='budget = shortest path length + slack (for Beam and Rollout, the length of their default policy path + slack)')
+    parser.add_argument('--branch_and_bound', action='store_true', help='find the most informative path with branch and bound instead of enumerating all paths (entropy only)')
+    parser.add_argument('--stream_paths', action='store_true', help='generate paths one at a time and keep only the selected ones')
+    parser.add_argument('--prune_dominated', action='store_true', help='skip paths covering only samples covered by another path with the same cost')
+    parser.add_argument('--strategy', default='MaxEnt', help='path planning strategy {MaxEnt, Shortest, Equi-Sample, Beam, Rollout}')
+    parser.add_argument('--beam_width', default=10, type=int, help='number of partial paths kept by the Beam strategy')
+    parser.add_argument('--num_rollouts', default=8, type=int, help='number of rollouts per move of the Rollout strategy')
+    parser.add_argument('--planning_budget', default=None, type=float, help='time (in seconds) for finding paths in each run, None for exhaustive search')
     parser.add_argument('--num_test', default=40, type=int, help='number of test samples')
+    parser.add_argument('--num_workers', default=1, type=int, help='number of processes used for searching and scoring candidate paths')
+    parser.add_argument('--precompute_distances', action='store_true', help='precompute distances between all map cells for planning')
+    parser.add_argument('--distance_table', default=None, help='file to load (or save) precomputed distances from')
 
     parser.add_argument('--update', action='store_true', help='update gp model')
     parser.add_argument('--update_every', default=1, type=int, help='update gp model every ... batch')
     parser.add_argument('--criterion', default='entropy', help='one from {mutual_information, entropy}')
+    parser.add_argument('--greedy', default='standard', choices=['standard', 'lazy', 'stochastic'], help='greedy selection of static samples {standard, lazy, stochastic}, lazy only with entropy')
+    parser.add_argument('--stochastic_epsilon', default=.1, type=float, help='stochastic greedy evaluates (n/k)*log(1/epsilon) candidates per step')
     # parser.add_argument('--mobile_std', default=.5, type=float, help='standard deviation of mobile measurements')
     parser.add_argument('--static_std', default=.1, type=float, help='standard deviation of static measurements')
     
@@ -1,21 +1,30 @@
 import numpy as np
 import seaborn as sns
 import time
+import heapq
+import atexit
+import multiprocessing
 import matplotlib.pyplot as plt
 from networkx import nx
-from copy import deepcopy
 
 from map import Map
-from utils import is_valid_cell, load_data_from_pickle, draw_path, manhattan_distance, generate_phenotype_data
-from graph_utils import get_down_and_up_nodes, edge_cost, get_heading, find_merge_to_node, lower_bound_path_cost
+from utils import is_valid_cell, load_data_from_pickle, draw_path, manhattan_distance, generate_phenotype_data, LRUCache
+from graph_utils import get_all_down_and_up_nodes, edge_cost, get_heading, PathCostLowerBound, SearchTree, GraphOverlay, DominatedParentFilter
           
 import ipdb
 
 
 class FieldEnv(object):
     # grid-based simulation environment 
-    def __init__(self, data_file=None, phenotype='plant_count', num_test=40):
+    def __init__(self, data_file=None, phenotype='plant_count', num_test=40, path_cache_size=64, max_cached_paths=200000, prune_dominated=False,
+                 num_workers=1):
         super(FieldEnv, self).__init__()
+        # number of processes exploring subtrees of the path search (see _parallel_search)
+        self.num_workers = num_workers
+        # skip paths covering only gp indices covered by another path with the same cost (see DominatedParentFilter)
+        self.prune_dominated = prune_dominated
+        # results of get_all_paths (limited by number of searches and total number of paths)
+        self.path_cache = LRUCache(max_entries=path_cache_size, max_size=max_cached_paths, size_fn=lambda res: len(res[0]))
         if data_file is None:
             self.num_rows = 30
             self.num_cols = 30
@@ -69,8 +78,9 @@ class FieldEnv(object):
 
         # setup map and pose-index and index-pose lookup tables
         self.map = Map(self.num_rows, self.num_cols, num_row_passes=4)
-        self.map_pose_to_gp_index_matrix = np.full(self.map.shape, None)
-        self.gp_index_to_map_pose_array = np.full(len(self.X), None)
+        # -1 if there is no sample at a map pose
+        self.map_pose_to_gp_index_matrix = np.full(self.map.shape, -1, dtype=np.int32)
+        self.gp_index_to_map_pose_array = np.full((len(self.X), 2), -1, dtype=np.int32)
 
     # TODO: merge this with the next function
     def _place_samples_others(self, row_start=0, row_inc=1):
@@ -132,10 +142,24 @@ class FieldEnv(object):
                     indices = self.gp_indices_between(node, neighbor)
                     self.graph.add_edge(node, neighbor, indices=indices)
 
-        # store a backup graph (or restore point)
-        self.backup_graph = deepcopy(self.graph)
+        # move gp indices of the edges to csr arrays, edges only keep their id
+        all_indices = []
+        for k, (u, v, data) in enumerate(self.graph.edges(data=True)):
+            all_indices.append(data.pop('indices'))
+            data['edge'] = k
+        self.base_edge_indptr, self.base_edge_index_array = self._edge_indices_to_csr(all_indices)
+        self.edge_indptr, self.edge_index_array = self.base_edge_indptr, self.base_edge_index_array
+
+    def _edge_indices_to_csr(self, all_indices, offset=0):
+        # gp indices of the k^{th} edge are index_array[indptr[k]:indptr[k+1]]
+        indptr = offset + np.cumsum([0] + [len(ind) for ind in all_indices])
+        index_array = np.concatenate([np.zeros(0, dtype=np.int32)] + [np.asarray(ind, dtype=np.int32) for ind in all_indices])
+        return indptr, index_array
 
     def _pre_search(self, start, waypoints):
+        # start and waypoints are added to an overlay on top of the junction graph (the junction graph is not modified)
+        self.graph = GraphOverlay(self.graph)
+
         # nodes and edges to be added to the graph and the edges to be removed from the graph
         new_nodes, new_edges, new_edges_indices, remove_edges = self.get_new_nodes_and_edges([start] + waypoints)
         
@@ -143,9 +167,13 @@ class FieldEnv(object):
         for node in new_nodes:
             self.graph.add_node(node, pose=(node[1],self.map.shape[0]-node[0]), new='True')
         
-        # add edges
-        for edge, indices in zip(new_edges, new_edges_indices):
-            self.graph.add_edge(edge[0], edge[1], indices=indices)    
+        # add edges (their gp indices are appended to the csr arrays of the junction graph)
+        num_edges = len(self.base_edge_indptr) - 1
+        for k, edge in enumerate(new_edges):
+            self.graph.add_edge(edge[0], edge[1], edge=num_edges + k)
+        indptr, index_array = self._edge_indices_to_csr(new_edges_indices, offset=self.base_edge_indptr[-1])
+        self.edge_indptr = np.concatenate([self.base_edge_indptr, indptr[1:]])
+        self.edge_index_array = np.concatenate([self.base_edge_index_array, index_array])
         
         # remove redundant edges (these edges have been replaced by edges between waypoints and map junctions)
         self.graph.remove_edges_from(remove_edges)  
@@ -165,23 +193,27 @@ class FieldEnv(object):
         # return nodes and edges to be added to the graph and the edges to be removed from the graph
         
         # nodes not present in the graph already
-        new_nodes = [n for n in new_nodes if n not in self.graph.nodes()]
+        new_nodes = [n for n in new_nodes if n not in self.graph]
         new_edges = []
         new_edges_indices = []
         remove_edges = []
 
+        if len(new_nodes) == 0:
+            return new_nodes, new_edges, new_edges_indices, remove_edges
+
+        # junctions and nearest new nodes above and below each node
+        down_juncs = [tuple(j) for j in self.map.get_down_junctions(new_nodes)]
+        up_juncs = [tuple(j) for j in self.map.get_up_junctions(new_nodes)]
+        down_nodes, up_nodes = get_all_down_and_up_nodes(new_nodes, down_juncs, up_juncs)
+
         # for each node find edges to be added and to be removed from the graph
-        for node in new_nodes:
-            down_junc = self.map.get_down_junction(node)
-            up_junc = self.map.get_up_junction(node)
-            down_node, up_node = get_down_and_up_nodes(node, new_nodes, down_junc, up_junc)
-            
+        for node, down_junc, up_junc, down_node, up_node in zip(new_nodes, down_juncs, up_juncs, down_nodes, up_nodes):
             down_indices = self.gp_indices_between(down_node, node)
-            if self.map_pose_to_gp_index_matrix[down_node] is not None:
-                down_indices.pop(0)
+            if self.map_pose_to_gp_index_matrix[down_node] >= 0:
+                down_indices = down_indices[1:]
             up_indices = self.gp_indices_between(up_node, node)
-            if self.map_pose_to_gp_index_matrix[up_node] is not None:
-                up_indices.pop(0)
+            if self.map_pose_to_gp_index_matrix[up_node] >= 0:
+                up_indices = up_indices[1:]
             
             new_edges.append((down_node, node))
             new_edges.append((node, up_node))
@@ -192,130 +224,558 @@ class FieldEnv(object):
         return new_nodes, new_edges, new_edges_indices, remove_edges
 
     def _post_search(self):
-        self.graph = deepcopy(self.backup_graph)
+        # discard the overlay
+        self.graph = self.graph.base
+        self.edge_indptr, self.edge_index_array = self.base_edge_indptr, self.base_edge_index_array
 
-    def get_all_paths(self, start, heading, waypoints, heuristic_cost=None, slack=0):
-        self._pre_search(start, waypoints)
+    def get_all_paths(self, start, heading, waypoints, heuristic_cost=None, slack=0, time_budget=None, return_exhaustive=False):
+        # with a time_budget (in seconds) the search is stopped when the budget is used up (anytime planning)
+        # and the feasible paths found so far are returned, at least one path is always returned
+        # return_exhaustive also returns whether all the paths were enumerated
+        deadline = None if time_budget is None else time.time() + time_budget
+
+        # agents starting from the same state often repeat searches, so results are cached
+        # the order of waypoints doesn't change the set of paths, and neither does heuristic_cost (an upper bound of
+        # the least cost), so it is only computed when the paths aren't cached
+        key = (tuple(start), tuple(heading), tuple(sorted(waypoints)), slack)
+        result = self.path_cache.get(key)
+        exhaustive = True
+        if result is None:
+            if heuristic_cost is None:
+                heuristic_cost = self.get_heuristic_cost(start, heading, waypoints, deadline=deadline)
+            (all_paths, all_paths_indices, all_paths_cost), exhaustive = self._get_all_paths(start, heading, waypoints, heuristic_cost, slack, deadline)
+            # cached paths are shared by all the callers, so they are immutable (tuples and read-only arrays)
+            for indices in all_paths_indices:
+                indices.setflags(write=False)
+            result = ([tuple(locs) for locs in all_paths], all_paths_indices, all_paths_cost)
+            # partial results are not reused
+            if exhaustive:
+                self.path_cache.put(key, result)
+        all_paths, all_paths_indices, all_paths_cost = result
+        if return_exhaustive:
+            return list(all_paths), list(all_paths_indices), list(all_paths_cost), exhaustive
+        return list(all_paths), list(all_paths_indices), list(all_paths_cost)
 
+    def _search_tree(self, start, heading, waypoints, heuristic_cost=None, slack=0, deadline=None, root_visited=0, root_gval=0,
+                     incumbent=None, split=None):
+        # best first expansion of the search states within least_cost + slack (merged states have more than one parent)
+        # paths are the paths from the root to the nodes of closed_list which are within least_cost + slack
+        # the root can be an intermediate state (root_visited, root_gval), e.g. the root of a subtree
+        # incumbent is a shared value (multiprocessing.Value) holding the least cost found by all the searches
+        # with split, the expansion stops once split nodes are open and the open nodes are also returned
         # start_time = time.time()
         nw = len(waypoints)
+        all_visited = (1 << nw) - 1
+        waypoint_bits = {w: 1 << i for i, w in enumerate(waypoints)}
         # expansion tree
-        tree = nx.DiGraph()
-        # node attributes = {pos, gval, visited, heading}
-
-        root = 0
-        tree.add_node(root, pose=start, heading=heading, visited=[False]*nw, gval=0)
-        open_list = [root]
+        tree = SearchTree()
+        root = tree.add_node(start, heading, root_visited, root_gval)
+        # paths dominated by another path of the same state are not added (see DominatedParentFilter)
+        dominated_filter = None
+        if self.prune_dominated:
+            dominated_filter = DominatedParentFilter(tree)
+            dominated_filter.add_node(root)
+            # gp indices covered by each edge as a bitset
+            edge_covered = dict()
+        # heap of (gval + lower bound on the cost to go, node index)
+        open_list = [(0, root)]
         closed_list = []
 
-        least_cost = self.get_heuristic_cost(start, heading, waypoints) if heuristic_cost is None else heuristic_cost
+        least_cost = self.get_heuristic_cost(start, heading, waypoints, deadline=deadline) if heuristic_cost is None else heuristic_cost
+        lower_bound = PathCostLowerBound(self.map, waypoints)
 
-        # for efficieny, it will be beneficial if nodes are expanded in increasing order of gval
-        idx = root
+        # best first expansion tightens least_cost early
         count_merged = 0
         # count_skipped = 0
+        exhaustive = True
         while len(open_list) > 0:
-            parent_idx = open_list.pop(0)
-            tree_node = tree.node[parent_idx]
-            pose = tree_node['pose']
-            gval = tree_node['gval']
+            if deadline is not None and time.time() > deadline:
+                exhaustive = False
+                if len(closed_list) == 0:
+                    # no path found yet, complete the most promising open node with the default policy
+                    closed_list.append(self._complete_node(tree, open_list[0][1], waypoints, waypoint_bits))
+                    goal_gval = tree.gval[closed_list[0]]
+                    # the completion is returned even if it exceeds least_cost + slack
+                    least_cost = goal_gval if goal_gval > least_cost + slack else min(least_cost, goal_gval)
+                break
+            if split is not None and len(open_list) >= split:
+                break
+            fval, parent_idx = heapq.heappop(open_list)
+            if incumbent is not None:
+                least_cost = min(least_cost, incumbent.value)
+            # least_cost might have decreased since the node was added
+            if fval > least_cost + slack:
+                continue
+            pose = tree.pose[parent_idx]
+            gval = tree.gval[parent_idx]
+            visited = tree.visited[parent_idx]
 
             ngh = self.graph.neighbors(pose)
             for new_pose in ngh:
-                cost = edge_cost(pose, tree_node['heading'], new_pose)
+                cost = edge_cost(pose, tree.heading[parent_idx], new_pose)
                 # can't move back to its parent node (or can't take a u-turn)
                 if cost == np.inf:
                     continue
                 new_gval = gval + cost
 
                 new_heading = get_heading(pose, new_pose)
-                new_visited = deepcopy(tree_node['visited'])
-                if new_pose in waypoints:
-                    new_visited[waypoints.index(new_pose)] = True
+                new_visited = visited | waypoint_bits.get(new_pose, 0)
 
-                remaining_waypoints = [w for i,w in enumerate(waypoints) if not new_visited[i]]
                 # min_dist_to_go = self.get_heuristic_cost(new_pose, new_heading, remaining_waypoints, least_cost)
-                min_dist_to_go = lower_bound_path_cost(new_pose, remaining_waypoints)
+                min_dist_to_go = lower_bound(new_pose, new_heading, new_visited)
                 if new_gval + min_dist_to_go > least_cost + slack:
                     # print('Skipping!')
                     continue
                 
-                new_tree_node = dict(pose=new_pose, heading=new_heading, visited=new_visited, gval=new_gval)
-                merge_to = find_merge_to_node(tree, new_tree_node)
+                if dominated_filter is not None and (pose, new_pose) not in edge_covered:
+                    edge_covered[pose, new_pose] = sum(1 << int(i) for i in self.edge_gp_indices(pose, new_pose))
+
+                merge_to = tree.find(new_pose, new_heading, new_visited, new_gval)
                 if merge_to is not None:
-                    tree.add_edge(parent_idx, merge_to, weight=cost)
+                    if dominated_filter is None:
+                        tree.add_parent(merge_to, parent_idx)
+                    else:
+                        dominated_filter.merge(merge_to, parent_idx, edge_covered[pose, new_pose])
                     count_merged += 1
                     # print('Merging')
                     continue
-                
-                # NOTE: because of gp_indices computation, this is slow
-                # with the new method, this can be uncommented for further tree pruning
-                # action = self.node_action(tree, new_tree_node, tree_node, parent_idx)
-                # if action == 'continue':
-                #     count_skipped += 1
-                #     continue
-
-                # if action is not None:
-                #     tree.add_edge(parent_idx, action, weight=cost)
-                #     count_merged += 1
-                #     continue
-                    
+
                 # add new node to tree
-                idx = idx + 1
-                tree.add_node(idx, **new_tree_node)
-                tree.add_edge(parent_idx, idx, weight=cost)
+                idx = tree.add_node(new_pose, new_heading, new_visited, new_gval, parent_idx)
+                if dominated_filter is not None:
+                    dominated_filter.add_node(idx, parent_idx, edge_covered[pose, new_pose])
 
-                if sum(new_visited) == nw:
+                if new_visited == all_visited:
                     least_cost = min(new_gval, least_cost)
                     closed_list.append(idx)
+                    if incumbent is not None and new_gval < incumbent.value:
+                        with incumbent.get_lock():
+                            incumbent.value = min(incumbent.value, new_gval)
                 else:
-                    open_list.append(idx)
-        
-        # end_time = time.time()
-        # print('Time {:4f}'.format(end_time-start_time))
+                    heapq.heappush(open_list, (new_gval + min_dist_to_go, idx))
 
-        # start_time = time.time()
-        all_paths_gen = [nx.all_shortest_paths(tree, root, t, weight='weight') for t in closed_list]
-        # end_time = time.time()
-        # print('Time {:4f}'.format(end_time-start_time))
+        if split is not None:
+            # in the order they would have been expanded
+            return tree, closed_list, least_cost, exhaustive, [idx for fval, idx in sorted(open_list) if fval <= least_cost + slack]
+        return tree, closed_list, least_cost, exhaustive
+
+    def _get_all_paths(self, start, heading, waypoints, heuristic_cost=None, slack=0, deadline=None):
+        self._pre_search(start, waypoints)
+        if self.num_workers > 1:
+            result, exhaustive = self._parallel_search(start, heading, waypoints, heuristic_cost, slack, deadline)
+        else:
+            tree, closed_list, least_cost, exhaustive = self._search_tree(start, heading, waypoints, heuristic_cost, slack, deadline)
+            result, paths_exhaustive = self._extract_paths(tree, closed_list, least_cost, slack, deadline)
+            exhaustive = exhaustive and paths_exhaustive
+        self._post_search()
+        return result, exhaustive
 
+    def _extract_paths(self, tree, closed_list, least_cost, slack=0, deadline=None):
         # start_time = time.time()
         all_paths = []
         all_paths_indices = []
         all_paths_cost = []
-        for path_gen in all_paths_gen:
-            for i, path in enumerate(path_gen):
-                path_cost = tree.node[path[-1]]['gval']
-                if path_cost > least_cost + slack:
-                    continue
+        exhaustive = True
+        # with a deadline, cheaper paths are extracted first
+        if deadline is not None:
+            closed_list = sorted(closed_list, key=lambda idx: tree.gval[idx])
+        # gp indices of every tree edge (parent, child), so each edge is looked up in the graph only once
+        edge_indices = dict()
+        for idx in range(len(tree)):
+            for p in tree.parents(idx):
+                edge_indices[p, idx] = self.edge_gp_indices(tree.pose[p], tree.pose[idx])
+        empty = np.zeros(0, dtype=np.int32)
+        for goal_idx in closed_list:
+            path_cost = tree.gval[goal_idx]
+            if path_cost > least_cost + slack:
+                continue
 
+            for path in tree.paths_to(goal_idx):
+                if deadline is not None and len(all_paths) > 0 and time.time() > deadline:
+                    exhaustive = False
+                    break
                 all_paths_cost.append(path_cost)
-                locs = [tree.node[p]['pose'] for p in path]
+                locs = [tree.pose[p] for p in path]
                 # gp_indices contains only mobile sensing locations
-                gp_indices = [self.graph.get_edge_data(locs[t], locs[t+1])['indices'] for t in range(len(locs) - 1)]
-                # gp_indices = [self.gp_indices_between(locs[t],locs[t+1]) for t in range(len(path)-1)]
-                
-                gp_indices = [item for sublist in gp_indices for item in sublist]
+                gp_indices = np.concatenate([empty] + [edge_indices[edge] for edge in zip(path, path[1:])])
                 all_paths_indices.append(gp_indices)
                 
                 all_paths.append(locs)
+
+            if deadline is not None and len(all_paths) > 0 and time.time() > deadline:
+                exhaustive = False
+                break
                 
         # end_time = time.time()
         # print('Time {:4f}'.format(end_time-start_time))
 
-        # print(count_merged)
-        # print(count_skipped)
         # print(len(all_paths))
+        return (all_paths, all_paths_indices, all_paths_cost), exhaustive
+
+    def _parallel_search(self, start, heading, waypoints, heuristic_cost=None, slack=0, deadline=None, tasks_per_worker=4):
+        # the first levels are expanded here until enough nodes are open, the subtree of each open node is searched
+        # by a worker process and its paths are appended to the paths from the root to the open node
+        # workers share the least cost found so far, so a path found by one worker prunes the subtrees of the others
+        # with fewer open nodes than workers (most of the search is pruned) the subtrees are searched here
+        tree, closed_list, least_cost, exhaustive, frontier = self._search_tree(start, heading, waypoints, heuristic_cost, slack, deadline,
+                                                                                split=self.num_workers*tasks_per_worker)
+        results = []
+        if len(frontier) >= self.num_workers:
+            pool = _search_pools.get(self.num_workers)
+            if pool is None or not pool.matches(self):
+                if pool is not None:
+                    pool.close()
+                pool = _search_pools[self.num_workers] = SearchPool(self, self.num_workers)
+            tasks = [(tree.pose[idx], tree.heading[idx], tree.visited[idx], tree.gval[idx], waypoints, least_cost, slack, deadline)
+                     for idx in frontier]
+            results, incumbent = pool.map(self, tasks, least_cost)
+            least_cost = min(least_cost, incumbent)
+        else:
+            for idx in frontier:
+                results.append(self._search_subtree(tree.pose[idx], tree.heading[idx], tree.visited[idx], tree.gval[idx], waypoints,
+                                                    least_cost, slack, deadline))
+                least_cost = min([least_cost] + results[-1][0][2])
+
+        (all_paths, all_paths_indices, all_paths_cost), paths_exhaustive = self._extract_paths(tree, closed_list, least_cost, slack, deadline)
+        exhaustive = exhaustive and paths_exhaustive
+        # subtrees in a fixed order, so the result doesn't depend on the timing of the workers
+        for idx, ((paths, paths_indices, paths_cost), subtree_exhaustive) in zip(frontier, results):
+            exhaustive = exhaustive and subtree_exhaustive
+            prefixes = [[tree.pose[p] for p in path] for path in tree.paths_to(idx)]
+            prefixes_indices = [self.gp_indices_on_path(locs) for locs in prefixes]
+            for path, indices, cost in zip(paths, paths_indices, paths_cost):
+                if cost > least_cost + slack:
+                    continue
+                for locs, prefix_indices in zip(prefixes, prefixes_indices):
+                    all_paths.append(locs + path[1:])
+                    all_paths_indices.append(np.concatenate([prefix_indices, indices]))
+                    all_paths_cost.append(cost)
+        return (all_paths, all_paths_indices, all_paths_cost), exhaustive
+
+    def _search_subtree(self, pose, heading, visited, gval, waypoints, least_cost, slack=0, deadline=None, incumbent=None):
+        # paths (sorted by cost) from an open node of a split search to the goals (see _parallel_search)
+        tree, closed_list, least_cost, exhaustive = self._search_tree(pose, heading, waypoints, least_cost, slack, deadline,
+                                                                      root_visited=visited, root_gval=gval, incumbent=incumbent)
+        (paths, paths_indices, paths_cost), paths_exhaustive = self._extract_paths(tree, closed_list, least_cost, slack, deadline)
+        # the nodes in the subtree depend on when the other workers found their paths, so the paths are sorted
+        order = sorted(range(len(paths)), key=lambda i: (paths_cost[i], paths[i]))
+        result = ([paths[i] for i in order], [paths_indices[i] for i in order], [paths_cost[i] for i in order])
+        return result, exhaustive and paths_exhaustive
+
+    def _search_state(self):
+        # attributes needed to search paths on the junction graph (shared with the worker processes once)
+        graph = self.graph.base if isinstance(self.graph, GraphOverlay) else self.graph
+        return {'graph': graph, 'map': self.map, 'base_edge_indptr': self.base_edge_indptr, 'base_edge_index_array': self.base_edge_index_array,
+                'edge_indptr': self.base_edge_indptr, 'edge_index_array': self.base_edge_index_array, 'prune_dominated': self.prune_dominated}
+
+    def _search_overlay(self):
+        # overlay of the current search on top of _search_state (the start and waypoints nodes and edges)
+        return self.graph.diff(), self.edge_indptr[len(self.base_edge_indptr):], self.edge_index_array[len(self.base_edge_index_array):]
+
+    def _set_search_overlay(self, overlay):
+        diff, indptr, index_array = overlay
+        self.graph = GraphOverlay.from_diff(self.graph.base if isinstance(self.graph, GraphOverlay) else self.graph, diff)
+        self.edge_indptr = np.concatenate([self.base_edge_indptr, indptr])
+        self.edge_index_array = np.concatenate([self.base_edge_index_array, index_array])
+
+    @classmethod
+    def _from_search_state(cls, state):
+        env = cls.__new__(cls)
+        for key, val in state.items():
+            setattr(env, key, val)
+        env.num_workers = 1
+        return env
+
+    def _alive_tree(self, tree, closed_list, least_cost, slack):
+        # nodes leading to a complete path within least_cost + slack, their children leading to such a path and
+        # the gp indices along each edge (parent, child) between them (children have a larger gval than their parents)
+        children = tree.children()
+        alive = np.zeros(len(tree), dtype=bool)
+        alive[[idx for idx in closed_list if tree.gval[idx] <= least_cost + slack]] = True
+        edge_indices = dict()
+        for idx in np.argsort(tree.gval)[::-1]:
+            children[idx] = [c for c in children[idx] if alive[c]]
+            for child in children[idx]:
+                alive[idx] = True
+                edge_indices[idx, child] = self.edge_gp_indices(tree.pose[idx], tree.pose[child])
+        return alive, children, edge_indices
+
+    def iter_paths(self, start, heading, waypoints, heuristic_cost=None, slack=0, time_budget=None):
+        # generate the (checkpoints, gp indices, cost) of the paths of get_all_paths in increasing order of cost
+        # only the search tree is kept in memory and each path is built when it is requested, so the memory doesn't
+        # grow with the number of paths and the consumer can stop early (e.g. after the least cost paths)
+        # time_budget (in seconds) only limits the search, the consumer decides how many paths to generate
+        deadline = None if time_budget is None else time.time() + time_budget
+        self._pre_search(start, waypoints)
+        tree, closed_list, least_cost, _ = self._search_tree(start, heading, waypoints, heuristic_cost, slack, deadline)
+        alive, _, edge_indices = self._alive_tree(tree, closed_list, least_cost, slack)
         self._post_search()
-        return all_paths, all_paths_indices, all_paths_cost
 
-    def get_heuristic_cost(self, start, heading, waypoints, least_cost_ub=None, return_seq=False):
+        goals = sorted([idx for idx in closed_list if alive[idx]], key=lambda idx: tree.gval[idx])
+        for goal_idx in goals:
+            for path in tree.paths_to(goal_idx):
+                indices = np.concatenate([np.zeros(0, dtype=np.int32)] + [edge_indices[path[t], path[t+1]] for t in range(len(path) - 1)])
+                yield [tree.pose[p] for p in path], indices, tree.gval[goal_idx]
+
+    def get_best_paths(self, start, heading, waypoints, path_gain, heuristic_cost=None, slack=0, num_paths=1, time_budget=None, return_exhaustive=False):
+        # most informative paths (at most num_paths, in decreasing order of gain) among all the paths of get_all_paths
+        # path_gain (a gp_utils.PathGain) scores partial paths while the search tree is traversed depth first, and a
+        # branch is pruned when even its optimistic gain can't beat the num_paths^{th} best complete path; only the
+        # search tree (whose size grows much slower than the number of paths) and the best paths are kept in memory
+        # with a time_budget (in seconds) the best paths found so far are returned
+        # the bound needs a submodular gain, so only entropy is supported (see PathGain)
+        deadline = None if time_budget is None else time.time() + time_budget
+        self._pre_search(start, waypoints)
+        tree, closed_list, least_cost, exhaustive = self._search_tree(start, heading, waypoints, heuristic_cost, slack, deadline)
+        alive, children, edge_indices = self._alive_tree(tree, closed_list, least_cost, slack)
+        self._post_search()
+
+        # sum of the singleton gains of the best completion of each node
+        # (by submodularity, the gain of the rest of a path is at most the sum of the gains of its locations)
+        best_rest = np.zeros(len(tree))
+        singleton_gains = np.maximum(path_gain.singleton_gains, 0)
+        for idx in np.argsort(tree.gval)[::-1]:
+            for child in children[idx]:
+                best_rest[idx] = max(best_rest[idx], np.sum(singleton_gains[edge_indices[idx, child]]) + best_rest[child])
+
+        # more promising children first to find good paths early
+        for idx in np.where(alive)[0]:
+            children[idx] = sorted(children[idx], key=lambda c: -best_rest[c] - np.sum(singleton_gains[edge_indices[idx, c]]))
+
+        # min heap of (gain, count, node ids) of the best complete paths
+        best = []
+        count = 0
+        depth = len(path_gain.stack)
+        # stack of (node id, number of children visited), path_gain holds the gp indices of the path to the top node
+        stack = [(0, 0)] if alive[0] else []
+        while len(stack) > 0:
+            if deadline is not None and len(best) > 0 and time.time() > deadline:
+                exhaustive = False
+                break
+            idx, k = stack.pop()
+            if k > 0:
+                # back from the subtree of the previous child
+                path_gain.pop()
+            while k < len(children[idx]):
+                child = children[idx][k]
+                k += 1
+                indices = edge_indices[idx, child]
+                if len(best) == num_paths and path_gain.value + np.sum(singleton_gains[indices]) + best_rest[child] <= best[0][0]:
+                    continue
+                gain = path_gain.push(indices)
+                if len(best) == num_paths and gain + best_rest[child] <= best[0][0]:
+                    path_gain.pop()
+                    continue
+                if len(children[child]) == 0:
+                    # complete path
+                    record = (gain, count, [i for i, _ in stack] + [idx, child])
+                    count += 1
+                    if len(best) < num_paths:
+                        heapq.heappush(best, record)
+                    else:
+                        heapq.heapreplace(best, record)
+                    path_gain.pop()
+                    continue
+                stack.append((idx, k))
+                stack.append((child, 0))
+                break
+        while len(path_gain.stack) > depth:
+            path_gain.pop()
+
+        paths, paths_indices, paths_cost, paths_gain = [], [], [], []
+        for gain, _, path in sorted(best, key=lambda b: (-b[0], b[1])):
+            paths.append([tree.pose[p] for p in path])
+            paths_indices.append(np.concatenate([np.zeros(0, dtype=np.int32)] + [edge_indices[path[t], path[t+1]] for t in range(len(path) - 1)]))
+            paths_cost.append(tree.gval[path[-1]])
+            paths_gain.append(gain)
+        if return_exhaustive:
+            return paths, paths_indices, paths_cost, paths_gain, exhaustive
+        return paths, paths_indices, paths_cost, paths_gain
+
+    def _successors(self, pose, heading, visited, gval, waypoint_bits):
+        # search states (pose, heading, visited, gval) reached by moving along an edge (u-turns are not allowed)
+        for new_pose in self.graph.neighbors(pose):
+            cost = edge_cost(pose, heading, new_pose)
+            if cost == np.inf:
+                continue
+            yield new_pose, get_heading(pose, new_pose), visited | waypoint_bits.get(new_pose, 0), gval + cost
+
+    def _default_policy(self, pose, heading, visited, gval, waypoints, waypoint_bits, max_cost=np.inf, lower_bound=None, epsilon=0):
+        # complete a search state by moving to the neighbor closest to finishing the nearest waypoint tour
+        # (Map.nearest_waypoint_path_cost), except for a random move with probability epsilon
+        # with a lower_bound, only moves that can finish within max_cost are taken
+        # returns the states (pose, heading, visited, gval) after each move, None if it runs out of moves
+        all_visited = (1 << len(waypoints)) - 1
+        states = []
+        while visited != all_visited:
+            moves = list(self._successors(pose, heading, visited, gval, waypoint_bits))
+            if lower_bound is not None:
+                moves = [s for s in moves if s[3] + lower_bound(*s[:3]) <= max_cost]
+            if len(moves) == 0:
+                return None
+            if epsilon > 0 and np.random.rand() < epsilon:
+                move = moves[np.random.randint(len(moves))]
+            else:
+                cost_to_go = []
+                for new_pose, new_heading, new_visited, new_gval in moves:
+                    remaining = [w for i, w in enumerate(waypoints) if not (new_visited >> i) & 1]
+                    cost_to_go.append(new_gval + self.map.nearest_waypoint_path_cost(new_pose, new_heading, remaining))
+                move = moves[int(np.argmin(cost_to_go))]
+            states.append(move)
+            pose, heading, visited, gval = move
+        return states
+
+    def _complete_node(self, tree, idx, waypoints, waypoint_bits):
+        # add the default policy completion of a node to the tree and return the index of its goal node
+        states = self._default_policy(tree.pose[idx], tree.heading[idx], tree.visited[idx], tree.gval[idx], waypoints, waypoint_bits)
+        for state in states:
+            merge_to = tree.find(*state)
+            if merge_to is not None:
+                tree.add_parent(merge_to, idx)
+                idx = merge_to
+            else:
+                idx = tree.add_node(*state, parent=idx)
+        return idx
+
+    def _default_policy_budget(self, start, heading, waypoints, waypoint_bits, heuristic_cost=None):
+        # least cost used for the budget of the beam and rollout planners and the path they fall back to (checkpoints, cost)
+        # the default policy path costs at most the nearest waypoint tour, so it is a cheap upper bound of the least cost
+        # (exact when heuristic_cost is the least cost, e.g. from get_heuristic_cost, otherwise paths can be longer than
+        # the least cost + slack)
+        states = self._default_policy(start, heading, 0, 0, waypoints, waypoint_bits)
+        fallback = ([start] + [state[0] for state in states], states[-1][3] if len(states) > 0 else 0)
+        least_cost = fallback[1] if heuristic_cost is None else min(fallback[1], heuristic_cost)
+        return least_cost, fallback
+
+    def get_beam_path(self, start, heading, waypoints, path_score, heuristic_cost=None, slack=0, width=10, time_budget=None):
+        # most informative path within least_cost + slack found by a beam search, least_cost is the smaller of
+        # heuristic_cost and the cost of the default policy path (see _default_policy_budget)
+        # path_score maps a list of gp index arrays (paths) to their gains
+        # in each step the partial paths of the beam are extended by an edge and the width partial paths with the
+        # largest gain per unit cost of their cheapest completion are kept, so a step scores at most width * degree
+        # paths and the number of steps is bounded by the number of edges of a path
+        # returns the checkpoints, gp indices, cost and gain of the path (the default policy path if none is found)
+        deadline = None if time_budget is None else time.time() + time_budget
+        self._pre_search(start, waypoints)
+        all_visited = (1 << len(waypoints)) - 1
+        waypoint_bits = {w: 1 << i for i, w in enumerate(waypoints)}
+        lower_bound = PathCostLowerBound(self.map, waypoints)
+        least_cost, fallback = self._default_policy_budget(start, heading, waypoints, waypoint_bits, heuristic_cost)
+
+        # partial paths (checkpoints, heading, visited, gval, gp indices)
+        beam = [([start], heading, 0, 0, np.zeros(0, dtype=np.int32))]
+        best = None
+        while len(beam) > 0:
+            if deadline is not None and time.time() > deadline:
+                break
+            candidates = []
+            fvals = []
+            for locs, h, visited, gval, indices in beam:
+                for new_pose, new_heading, new_visited, new_gval in self._successors(locs[-1], h, visited, gval, waypoint_bits):
+                    min_dist_to_go = lower_bound(new_pose, new_heading, new_visited)
+                    if new_gval + min_dist_to_go > least_cost + slack:
+                        continue
+                    new_indices = np.concatenate([indices, self.edge_gp_indices(locs[-1], new_pose)])
+                    candidates.append((locs + [new_pose], new_heading, new_visited, new_gval, new_indices))
+                    fvals.append(new_gval + min_dist_to_go)
+            if len(candidates) == 0:
+                break
+            gains = path_score([c[4] for c in candidates])
+
+            # partial paths reaching the same search state have the same completions, only the best one is kept
+            states = dict()
+            for k, (locs, h, visited, gval, indices) in enumerate(candidates):
+                if visited == all_visited:
+                    if best is None or gains[k] > best[3]:
+                        best = (locs, indices, gval, gains[k])
+                    continue
+                key = (locs[-1], h, visited, gval)
+                if key not in states or gains[k] > gains[states[key]]:
+                    states[key] = k
+            order = sorted(states.values(), key=lambda k: -gains[k] / fvals[k])
+            beam = [candidates[k] for k in order[:width]]
+        if best is None:
+            indices = self.gp_indices_on_path(fallback[0])
+            best = (fallback[0], indices, fallback[1], path_score([indices])[0])
+        self._post_search()
+        return best
+
+    def get_rollout_path(self, start, heading, waypoints, path_score, heuristic_cost=None, slack=0, num_rollouts=8, epsilon=.2,
+                         time_budget=None):
+        # most informative path within least_cost + slack found by monte carlo rollouts, least_cost is the smaller of
+        # heuristic_cost and the cost of the default policy path (see _default_policy_budget)
+        # the path is built an edge at a time, every feasible edge is valued by the best gain of num_rollouts
+        # completions of the path and the best edge is taken
+        # completions follow the default policy of moving to the neighbor closest to finishing the nearest waypoint
+        # tour (Map.nearest_waypoint_path_cost), except for a random feasible move with probability epsilon
+        # (the first completion is always the default policy), so there are at most num_rollouts * degree
+        # completions per edge of the path
+        # returns the checkpoints, gp indices, cost and gain of the most informative completion (the default policy
+        # path if none is found)
+        deadline = None if time_budget is None else time.time() + time_budget
+        self._pre_search(start, waypoints)
+        all_visited = (1 << len(waypoints)) - 1
+        waypoint_bits = {w: 1 << i for i, w in enumerate(waypoints)}
+        lower_bound = PathCostLowerBound(self.map, waypoints)
+        least_cost, fallback = self._default_policy_budget(start, heading, waypoints, waypoint_bits, heuristic_cost)
+
+        def feasible(pose, h, visited, gval):
+            return [s for s in self._successors(pose, h, visited, gval, waypoint_bits) if s[3] + lower_bound(*s[:3]) <= least_cost + slack]
+
+        def rollout(locs, h, visited, gval, eps):
+            # complete the path with the default policy, None if it runs out of budget
+            states = self._default_policy(locs[-1], h, visited, gval, waypoints, waypoint_bits, least_cost + slack, lower_bound, eps)
+            if states is None:
+                return None
+            return locs + [state[0] for state in states], states[-1][3] if len(states) > 0 else gval
+
+        locs, h, visited, gval = [start], heading, 0, 0
+        best = None
+        while visited != all_visited:
+            if deadline is not None and time.time() > deadline:
+                break
+            moves = feasible(locs[-1], h, visited, gval)
+            completions = []
+            for r in range(num_rollouts):
+                # the default policy completions of all the moves come first
+                if r > 0 and deadline is not None and time.time() > deadline:
+                    break
+                for k, (new_pose, new_heading, new_visited, new_gval) in enumerate(moves):
+                    completion = rollout(locs + [new_pose], new_heading, new_visited, new_gval, 0 if r == 0 else epsilon)
+                    if completion is not None:
+                        completions.append((k,) + completion)
+            if len(completions) == 0:
+                break
+            completions_indices = [self.gp_indices_on_path(c[1]) for c in completions]
+            gains = path_score(completions_indices)
+            values = np.full(len(moves), -np.inf)
+            for (k, path, cost), indices, gain in zip(completions, completions_indices, gains):
+                values[k] = max(values[k], gain)
+                if best is None or gain > best[3]:
+                    best = (path, indices, cost, gain)
+            move = moves[int(np.argmax(values))]
+            locs.append(move[0])
+            h, visited, gval = move[1:]
+        if best is None:
+            indices = self.gp_indices_on_path(fallback[0])
+            best = (fallback[0], indices, fallback[1], path_score([indices])[0])
+        self._post_search()
+        return best
+
+    def get_heuristic_cost(self, start, heading, waypoints, least_cost_ub=None, return_seq=False, deadline=None):
+        # cost of the optimal sequence of waypoints (held-karp dynamic program over (visited, last waypoint, heading))
+        # with return_seq, returns the cost of each leg and the waypoint indices in the order they are visited
+        # once the deadline passes, the upper bound (the nearest waypoint tour) is returned instead
         if len(waypoints) == 0:
-            return 0
+            return ([], []) if return_seq else 0
 
         least_cost = self.map.nearest_waypoint_path_cost(start, heading, waypoints) if least_cost_ub is None else least_cost_ub
+        # start of the nearest waypoint tour (start is moved to the first junction below)
+        tour_start = (start, heading)
         
         gval = 0
+        # indices of waypoints not covered while moving to the first junction
+        remaining = list(range(len(waypoints)))
         if start[0] not in self.map.row_pass_indices:
             if heading not in [(1,0), (-1,0)]:
                 raise ValueError('Impossible setting encountered!!')
@@ -332,83 +792,82 @@ class FieldEnv(object):
                     covered[itr] = True
                     costs[itr] = abs(start[0] - x)
                 x = x + heading[0]
-            waypoints = [w for i,w in enumerate(waypoints) if not covered[i]]
-            if len(waypoints) == 0:
+            remaining = [i for i in remaining if not covered[i]]
+            if len(remaining) == 0:
+                if return_seq:
+                    seq = list(np.argsort(costs))
+                    return list(np.diff([0] + [costs[i] for i in seq])), seq
                 return max(costs)
             gval = manhattan_distance(start, junc)
             start = junc
         
-        nw = len(waypoints)
-        tree = nx.DiGraph()
-        # node attributes = {pos, gval, visited, heading}
+        nw = len(remaining)
+        all_visited = (1 << nw) - 1
+        # memoized distances (last waypoint, heading, next waypoint) -> (cost, final heading), last = -1 is the start
+        distances = dict()
+        # best (cost, previous state) of each (last waypoint, heading) for every visited bitmask
+        states = [dict() for _ in range(all_visited + 1)]
+        states[0][(-1, heading)] = (gval, None)
+        # successors have more bits set, so bitmasks can be processed in increasing order
+        for visited in range(all_visited):
+            if deadline is not None and time.time() > deadline:
+                if return_seq:
+                    return self.map.nearest_waypoint_path_cost(*tour_start, waypoints, return_seq=True)
+                return least_cost
+            for (last, last_heading), (cost, _) in states[visited].items():
+                pose = start if last == -1 else waypoints[remaining[last]]
+                for i in range(nw):
+                    if (visited >> i) & 1:
+                        continue
+                    key = (last, last_heading, i)
+                    if key not in distances:
+                        distances[key] = self.map.distance_between_nodes(pose, waypoints[remaining[i]], last_heading)
+                    dist, final_heading = distances[key]
+                    new_cost = cost + dist
+                    if new_cost > least_cost:
+                        continue
+                    new_visited = visited | (1 << i)
+                    state = (i, final_heading)
+                    if state not in states[new_visited] or new_cost < states[new_visited][state][0]:
+                        states[new_visited][state] = (new_cost, (last, last_heading))
 
-        root = 0
-        tree.add_node(root, pose=start, heading=heading, visited=[False]*nw, gval=gval)
-        open_list = [root]
-        closed_list = []
-        idx = root
+        if len(states[all_visited]) == 0:
+            # no sequence is cheaper than the given upper bound
+            if return_seq:
+                raise ValueError('No waypoint sequence costs at most least_cost_ub={}'.format(least_cost_ub))
+            return least_cost
 
-        while len(open_list) > 0:
-            parent_idx = open_list.pop(0)
-            parent_node = tree.node[parent_idx]
-            
-            # neighbors are all the waypoints which haven't been visited yet
-            for i in range(nw):
-                if parent_node['visited'][i]:
-                    continue
+        state = min(states[all_visited], key=lambda s: states[all_visited][s][0])
+        least_cost = states[all_visited][state][0]
+        if not return_seq:
+            return least_cost
 
-                cost, final_heading = self.map.distance_between_nodes(parent_node['pose'], waypoints[i], parent_node['heading'])
-                new_gval = parent_node['gval'] + cost
-                if new_gval > least_cost:
-                    continue
+        # backtrack the optimal sequence
+        visited = all_visited
+        seq = []
+        leg_costs = []
+        while state[0] != -1:
+            cost, prev_state = states[visited][state]
+            prev_cost = states[visited ^ (1 << state[0])][prev_state][0]
+            seq.append(remaining[state[0]])
+            leg_costs.append(cost - prev_cost)
+            visited = visited ^ (1 << state[0])
+            state = prev_state
+        # waypoints covered before the first junction come first, in the order they are passed
+        pre_seq = sorted([i for i in range(len(waypoints)) if i not in remaining], key=lambda i: costs[i])
+        pre_costs = [costs[i] for i in pre_seq]
+        leg_costs[-1] += gval - (pre_costs[-1] if len(pre_costs) > 0 else 0)
+        return list(np.diff([0] + pre_costs)) + leg_costs[::-1], pre_seq + seq[::-1]
 
-                new_visited = np.copy(parent_node['visited'])
-                new_visited[i] = True
-                child_node = dict(pose=waypoints[i], heading=final_heading, visited=new_visited, gval=new_gval)
-                
-                idx += 1
-                tree.add_node(idx, **child_node)
-                tree.add_edge(parent_idx, idx, weight=cost)
-                if sum(new_visited) == nw:
-                    if new_gval <= least_cost:
-                        least_cost = new_gval
-                        best_idx = idx
-
-                    closed_list.append(idx)
-                else:
-                    open_list.append(idx)
-        if return_seq:
-            ipdb.set_trace()
-        return least_cost
+    def edge_gp_indices(self, node0, node1):
+        # gp indices along the edge between node0 and node1
+        k = self.graph.get_edge_data(node0, node1)['edge']
+        return self.edge_index_array[self.edge_indptr[k]:self.edge_indptr[k+1]]
 
     def gp_indices_on_path(self, path):
         # all gp indices lying on the path
-        gp_indices = [self.graph.get_edge_data(path[t], path[t+1])['indices'] for t in range(len(path) - 1)]
-        gp_indices = [item for sublist in gp_indices for item in sublist]        
-        return gp_indices
-
-    def node_action(self, tree, node, parent_node, parent_idx):
-        # all nodes in the graph with same attributes as node
-        all_idx = [n for n in tree.nodes() if tree.node[n]==node]
-        if len(all_idx) > 0:
-            assert len(all_idx)==1, 'More than one path found!!!'
-            sim_idx = all_idx[0]
-            # find gp indices along sim_node
-            gen = nx.all_shortest_paths(tree, 0, sim_idx, weight='weight')
-            sim_path = [p for p in gen]
-            sim_locs = [tree.node[p]['pose'] for p in sim_path[0]]
-            sim_gp_ind = self.gp_indices_on_path(sim_locs)
-            
-            gen = nx.all_shortest_paths(tree, 0, parent_idx)
-            parent_path = [p for p in gen]
-            locs = [tree.node[p]['pose'] for p in parent_path[0]] + [node['pose']]
-            gp_ind = self.gp_indices_on_path(locs)
-            
-            # do not add node to tree
-            if set(gp_ind).issubset(set(sim_gp_ind)):
-                return 'continue'
-            return all_idx[0]
-        return None  
+        gp_indices = [self.edge_gp_indices(path[t], path[t+1]) for t in range(len(path) - 1)]
+        return np.concatenate([np.zeros(0, dtype=np.int32)] + gp_indices)
 
     def get_path_from_checkpoints(self, checkpoints):
         # consecutive checkpoints are always aligned along either x-axis or y-axis
@@ -435,11 +894,10 @@ class FieldEnv(object):
         if diff[1] == 0:
             inc = diff[0]//abs(diff[0])
             indices = self.map_pose_to_gp_index_matrix[map_pose0[0]: map_pose1[0]: inc, map_pose0[1]]
-            indices = [ind for ind in indices if ind is not None]
-            return indices
+            return indices[indices >= 0]
 
     def gp_index_to_map_pose(self, gp_index):
-        return self.gp_index_to_map_pose_array[gp_index]
+        return tuple(int(x) for x in self.gp_index_to_map_pose_array[gp_index])
 
     def map_pose_to_gp_index(self, map_pose):
         assert isinstance(map_pose, tuple), 'Map pose must be a tuple'
@@ -449,10 +907,7 @@ class FieldEnv(object):
         # ax.set_title('Environment')
         sample_color = np.array([255,218,185])/255
         plot = 1.0 - np.repeat(self.map.occupied[:, :, np.newaxis], 3, axis=2)
-        for i in range(plot.shape[0]):
-            for j in range(plot.shape[1]):
-                if self.map_pose_to_gp_index_matrix[i,j] is not None:
-                    plot[i,j] = sample_color
+        plot[self.map_pose_to_gp_index_matrix >= 0] = sample_color
     
         all_paths_color = np.array([244,164,96])/255
         all_static_locations_color = np.array([127, 255, 0])/255
@@ -535,4 +990,63 @@ class FieldEnv(object):
         ipdb.set_trace()
 
 
+class SearchPool(object):
+    # persistent pool of worker processes searching subtrees (see FieldEnv._parallel_search)
+    # the junction graph, map and csr arrays are passed once when the workers are started, each search only sends
+    # the overlay of its start and waypoints, so the pool is reused as long as the junction graph is the same
+    def __init__(self, env, num_workers):
+        super(SearchPool, self).__init__()
+        self.num_workers = num_workers
+        self.state = env._search_state()
+        # least cost found by all the workers
+        self.incumbent = multiprocessing.Value('d', np.inf)
+        self.pool = multiprocessing.Pool(num_workers, initializer=_init_search_worker, initargs=(self.state, self.incumbent))
+        self.version = 0
+
+    def matches(self, env):
+        state = env._search_state()
+        return all(state[key] is self.state[key] for key in ['graph', 'map', 'base_edge_indptr', 'base_edge_index_array']) and \
+            state['prune_dominated'] == self.state['prune_dominated']
+
+    def map(self, env, tasks, least_cost):
+        # results of the tasks and the least cost found by the workers
+        self.version += 1
+        self.incumbent.value = least_cost
+        overlay = env._search_overlay()
+        results = self.pool.map(_worker_search_subtree, [(self.version, overlay) + task for task in tasks], chunksize=1)
+        return results, self.incumbent.value
+
+    def close(self):
+        self.pool.terminate()
+
+
+# pools shared by all the calls of FieldEnv._parallel_search (by number of workers)
+_search_pools = dict()
+
+
+@atexit.register
+def _close_search_pools():
+    for pool in _search_pools.values():
+        pool.close()
+    _search_pools.clear()
+
+
+# environment, version of its overlay and shared least cost of the worker processes (see SearchPool)
+_worker_env = None
+_worker_version = None
+_worker_least_cost = None
+
+
+def _init_search_worker(state, least_cost):
+    global _worker_env, _worker_least_cost
+    _worker_env = FieldEnv._from_search_state(state)
+    _worker_least_cost = least_cost
+
 
+def _worker_search_subtree(args):
+    global _worker_version
+    version, overlay = args[:2]
+    if version != _worker_version:
+        _worker_env._set_search_overlay(overlay)
+        _worker_version = version
+    return _worker_env._search_subtree(*args[2:], incumbent=_worker_least_cost)
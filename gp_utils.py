@@ -0,0 +1,746 @@
+import os
+import heapq
+import atexit
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from scipy.linalg import solve_triangular
+
+from utils import CONST, entropy_from_cov
+
+
+def cholesky_update(L, x, downdate=False):
+    # in-place rank-one update (or downdate) of lower triangular L such that L'L'^T = LL^T +/- xx^T
+    x = np.array(x, dtype=float)
+    sign = -1.0 if downdate else 1.0
+    nz = np.nonzero(x)[0]
+    start = nz[0] if len(nz) > 0 else len(x)
+    for k in range(start, len(x)):
+        r_sq = L[k, k]**2 + sign * x[k]**2
+        if r_sq <= 0:
+            raise np.linalg.LinAlgError('Matrix is not positive definite')
+        r = np.sqrt(r_sq)
+        c = r / L[k, k]
+        s = x[k] / L[k, k]
+        L[k, k] = r
+        L[k+1:, k] = (L[k+1:, k] + sign * s * x[k+1:]) / c
+        x[k+1:] = c * x[k+1:] - s * L[k+1:, k]
+    return L
+
+
+class IncrementalEntropy(object):
+    # entropy of the (noisy) measurements at the sampled locations
+    # a cholesky factor of the sampled covariance is maintained so that the gain of a candidate is
+    # given by its conditional variance (schur complement) and accepting a sample is a rank-one change
+    def __init__(self, cov_matrix, noise_var):
+        # noise_var is np.inf for all the locations which haven't been sampled yet
+        super(IncrementalEntropy, self).__init__()
+        self.cov_matrix = cov_matrix
+        self.noise_var = np.array(noise_var, dtype=float)
+        # number of calls to add (arrays of the engine may have changed in place)
+        self.num_updates = 0
+
+        # sampled indices in the order of rows of the cholesky factor
+        self.order = np.where(np.isfinite(self.noise_var))[0]
+        self.position = np.full(len(self.noise_var), -1)
+        self.position[self.order] = np.arange(len(self.order))
+
+        cov = self.cov_matrix[np.ix_(self.order, self.order)] + np.diag(self.noise_var[self.order])
+        self.L = np.linalg.cholesky(cov)
+        self._inv_L = None
+        self._cross = None
+
+    @property
+    def size(self):
+        return len(self.order)
+
+    @property
+    def value(self):
+        return self.size * CONST + np.sum(np.log(np.diag(self.L)))
+
+    @property
+    def inv_L(self):
+        # only needed for locations which are already in the sampled set
+        if self._inv_L is None:
+            self._inv_L = solve_triangular(self.L, np.eye(self.size), lower=True)
+        return self._inv_L
+
+    def gains(self, indices, var):
+        # change in entropy if the noise variance at indices[i] becomes var[i] (one location at a time)
+        indices = np.asarray(indices, dtype=int)
+        var = np.asarray(var, dtype=float)
+        utilities = np.zeros(len(indices))
+        pos = self.position[indices]
+        new = pos == -1
+
+        # new locations: H(x|a) = const + .5*log(conditional variance)
+        if np.any(new):
+            ind = indices[new]
+            w = solve_triangular(self.L, self.cov_matrix[np.ix_(self.order, ind)], lower=True)
+            cond_var = self.cov_matrix[ind, ind] + var[new] - np.sum(w**2, axis=0)
+            utilities[new] = CONST + .5 * np.log(cond_var)
+
+        # sampled locations: only a diagonal entry of the covariance changes
+        old = ~new
+        if np.any(old):
+            delta = var[old] - self.noise_var[indices[old]]
+            inv_diag = np.sum(self.inv_L[:, pos[old]]**2, axis=0)
+            utilities[old] = .5 * np.log1p(delta * inv_diag)
+        return utilities
+
+    @property
+    def cross(self):
+        # L^-1 C[a, :] is shared by all the candidates (and paths) until the sampled set changes
+        if self._cross is None:
+            self._cross = solve_triangular(self.L, self.cov_matrix[self.order], lower=True)
+        return self._cross
+
+    def _split(self, indices, var):
+        # split into new locations and sampled locations whose noise variance changes
+        indices = np.asarray(indices, dtype=int)
+        var = np.asarray(var, dtype=float)
+        new = self.position[indices] == -1
+        delta = var - self.noise_var[indices]
+        changed = ~new & (delta != 0)
+        return indices[new], var[new], indices[changed], delta[changed]
+
+    def _batch_gain(self, ind_new, var_new, ind_chg, delta_chg):
+        # joint gain of a batch of sets with the same number of new (s) and changed (c) locations
+        # ind_new, var_new are (b, s) and ind_chg, delta_chg are (b, c)
+        b, s = ind_new.shape
+        c = ind_chg.shape[1]
+        gain = np.zeros(b)
+
+        # A is the sampled covariance and D the diagonal change (U is the selection matrix of changed locations)
+        # log|A + UDU^T| - log|A| = log|I + D U^T A^-1 U|
+        if c > 0:
+            w_chg = np.transpose(self.inv_L[:, self.position[ind_chg]], (1, 0, 2))
+            m_cc = np.matmul(np.transpose(w_chg, (0, 2, 1)), w_chg)
+            gain += .5 * np.linalg.slogdet(np.eye(c) + delta_chg[:, :, None] * m_cc)[1]
+        if s == 0:
+            return gain
+
+        # schur complement of the new locations given the modified sampled set (woodbury identity)
+        w_new = np.transpose(self.cross[:, ind_new], (1, 0, 2))
+        m_nn = np.matmul(np.transpose(w_new, (0, 2, 1)), w_new)
+        if c > 0:
+            m_cn = np.matmul(np.transpose(w_chg, (0, 2, 1)), w_new)
+            inner = m_cc + np.eye(c) / delta_chg[:, :, None]
+            m_nn = m_nn - np.matmul(np.transpose(m_cn, (0, 2, 1)), np.linalg.solve(inner, m_cn))
+        schur = self.cov_matrix[ind_new[:, :, None], ind_new[:, None, :]] + np.eye(s) * var_new[:, :, None] - m_nn
+        gain += s * CONST + .5 * np.linalg.slogdet(schur)[1]
+        return gain
+
+    def _state(self):
+        # arrays needed to evaluate gains (shared with worker processes)
+        return {'cov_matrix': self.cov_matrix, 'noise_var': self.noise_var, 'order': self.order,
+                'position': self.position, 'inv_L': self.inv_L, 'cross': self.cross}
+
+    @classmethod
+    def _from_state(cls, state):
+        engine = cls.__new__(cls)
+        for key in ['cov_matrix', 'noise_var', 'order', 'position']:
+            setattr(engine, key, state[key])
+        engine.L = None
+        engine.num_updates = 0
+        engine._inv_L = state['inv_L']
+        engine._cross = state['cross']
+        return engine
+
+    def set_gain(self, indices, var):
+        # change in entropy if the noise variance at all the indices changes jointly
+        return self._batch_gain(*[x[None] for x in self._split(indices, var)])[0]
+
+    def set_gains(self, indices_list, var_list):
+        return batched_set_gains(self, indices_list, var_list)
+
+    def add(self, index, var):
+        # set noise variance of index to var and update the cholesky factor accordingly
+        p = self.position[index]
+        if p == -1:
+            m = self.size
+            w = solve_triangular(self.L, self.cov_matrix[self.order, index], lower=True)
+            d = np.sqrt(self.cov_matrix[index, index] + var - np.dot(w, w))
+            L = np.zeros((m+1, m+1))
+            L[:m, :m] = self.L
+            L[m, :m] = w
+            L[m, m] = d
+            self.L = L
+            self.order = np.append(self.order, index)
+            self.position[index] = m
+        else:
+            delta = var - self.noise_var[index]
+            x = np.zeros(self.size)
+            x[p] = np.sqrt(abs(delta))
+            cholesky_update(self.L, x, downdate=delta < 0)
+
+        self.noise_var[index] = var
+        self._inv_L = None
+        self._cross = None
+        self.num_updates += 1
+
+
+class IncrementalMutualInformation(object):
+    # mutual information between the sampled (a) and the unsampled (abar) locations: H(a) + H(abar) - H(all)
+    # the complement precision (inverse covariance of abar) and the precision of the whole field are cached
+    # so that every candidate costs O(1) after a rank-one update per accepted sample (krause et al.)
+    def __init__(self, cov_matrix, noise_var):
+        super(IncrementalMutualInformation, self).__init__()
+        self.cov_matrix = cov_matrix
+        self.noise_var = np.array(noise_var, dtype=float)
+        self.entropy = IncrementalEntropy(cov_matrix, noise_var)
+
+        # complement set
+        self.complement = np.where(~np.isfinite(self.noise_var))[0]
+        self.complement_position = np.full(len(self.noise_var), -1)
+        self.complement_position[self.complement] = np.arange(len(self.complement))
+        self.complement_precision = np.linalg.inv(self.cov_matrix[np.ix_(self.complement, self.complement)])
+        self.complement_logdet = np.linalg.slogdet(self.cov_matrix[np.ix_(self.complement, self.complement)])[1]
+
+        # whole field (unsampled locations do not add any noise)
+        cov_all = self.cov_matrix + np.diag(self._all_var(self.noise_var))
+        self.precision = np.linalg.inv(cov_all)
+        self.logdet = np.linalg.slogdet(cov_all)[1]
+
+    @staticmethod
+    def _all_var(var):
+        var = np.array(var, dtype=float)
+        var[~np.isfinite(var)] = 0.0
+        return var
+
+    @property
+    def size(self):
+        return self.entropy.size
+
+    @property
+    def num_updates(self):
+        # every add also updates the entropy engine
+        return self.entropy.num_updates
+
+    @property
+    def value(self):
+        ent_abar = len(self.complement) * CONST + .5 * self.complement_logdet
+        ent_all = len(self.noise_var) * CONST + .5 * self.logdet
+        return self.entropy.value + ent_abar - ent_all
+
+    def gains(self, indices, var):
+        # change in mutual information if the noise variance at indices[i] becomes var[i] (one location at a time)
+        indices = np.asarray(indices, dtype=int)
+        var = np.asarray(var, dtype=float)
+        if len(self.complement) == 0:
+            # every location has been sampled so H(a) = H(all)
+            return np.zeros(len(indices))
+        utilities = self.entropy.gains(indices, var)
+
+        # |C_{abar - i}| = |C_abar| * [C_abar^-1]_ii
+        pos = self.complement_position[indices]
+        in_complement = pos != -1
+        utilities[in_complement] += .5 * np.log(self.complement_precision[pos[in_complement], pos[in_complement]]) - CONST
+
+        # |C + D + delta e_i e_i^T| = |C + D| * (1 + delta [(C + D)^-1]_ii)
+        delta = var - self._all_var(self.noise_var[indices])
+        utilities -= .5 * np.log1p(delta * self.precision[indices, indices])
+        return utilities
+
+    def _split(self, indices, var):
+        # new locations are exactly the ones leaving the complement set
+        return self.entropy._split(indices, var)
+
+    def _batch_gain(self, ind_new, var_new, ind_chg, delta_chg):
+        b, s = ind_new.shape
+        if len(self.complement) == 0:
+            return np.zeros(b)
+        gain = self.entropy._batch_gain(ind_new, var_new, ind_chg, delta_chg)
+
+        # |C_{abar - S}| = |C_abar| * |[C_abar^-1]_SS|
+        if s > 0:
+            pos = self.complement_position[ind_new]
+            gain += .5 * np.linalg.slogdet(self.complement_precision[pos[:, :, None], pos[:, None, :]])[1] - s * CONST
+
+        # |C + D + U delta U^T| = |C + D| * |I + delta U^T (C + D)^-1 U|
+        ind = np.concatenate([ind_new, ind_chg], axis=1)
+        delta = np.concatenate([var_new, delta_chg], axis=1)
+        if ind.shape[1] > 0:
+            k = ind.shape[1]
+            gain -= .5 * np.linalg.slogdet(np.eye(k) + delta[:, :, None] * self.precision[ind[:, :, None], ind[:, None, :]])[1]
+        return gain
+
+    def _state(self):
+        state = {'entropy.' + key: val for key, val in self.entropy._state().items()}
+        state.update({'noise_var': self.noise_var, 'complement': self.complement, 'complement_position': self.complement_position,
+                      'complement_precision': self.complement_precision, 'precision': self.precision})
+        return state
+
+    @classmethod
+    def _from_state(cls, state):
+        engine = cls.__new__(cls)
+        for key in ['noise_var', 'complement', 'complement_position', 'complement_precision', 'precision']:
+            setattr(engine, key, state[key])
+        engine.cov_matrix = state['entropy.cov_matrix']
+        engine.entropy = IncrementalEntropy._from_state({key[8:]: val for key, val in state.items() if key.startswith('entropy.')})
+        return engine
+
+    def set_gain(self, indices, var):
+        # change in mutual information if the noise variance at all the indices changes jointly
+        return self._batch_gain(*[x[None] for x in self._split(indices, var)])[0]
+
+    def set_gains(self, indices_list, var_list):
+        return batched_set_gains(self, indices_list, var_list)
+
+    def add(self, index, var):
+        # remove index from the complement set
+        p = self.complement_position[index]
+        if p != -1:
+            q = self.complement_precision
+            self.complement_logdet += np.log(q[p, p])
+            keep = np.arange(len(self.complement)) != p
+            self.complement_precision = q[np.ix_(keep, keep)] - np.outer(q[keep, p], q[p, keep]) / q[p, p]
+            self.complement = self.complement[keep]
+            self.complement_position[index] = -1
+            self.complement_position[self.complement] = np.arange(len(self.complement))
+
+        # sherman-morrison update of the precision of the whole field
+        delta = var - self._all_var(self.noise_var[[index]])[0]
+        p_i = self.precision[:, index].copy()
+        self.logdet += np.log1p(delta * p_i[index])
+        self.precision -= delta * np.outer(p_i, p_i) / (1 + delta * p_i[index])
+
+        self.entropy.add(index, var)
+        self.noise_var[index] = var
+
+
+class PathGain(object):
+    # joint gain (same as engine.set_gain) of a growing set of locations, e.g. mobile samples along a partial path
+    # blocks of locations are pushed and popped in stack order (depth first search) and every push only appends
+    # rows to the factors, so a block costs O(k^2) per location instead of refactorizing the whole set
+    # var is the noise variance of a new measurement at every location (it can only reduce the variance of
+    # a sampled location); such a change is treated as an extra measurement y' with variance v',
+    # 1/var = 1/noise_var + 1/v', as H(y, y') = H(fused) + H(y - y') and y - y' is independent of the field
+    # only entropy is supported, the branch and bound using it needs a submodular gain
+    def __init__(self, engine, var, capacity=64):
+        super(PathGain, self).__init__()
+        if not isinstance(engine, IncrementalEntropy):
+            raise ValueError('PathGain only supports IncrementalEntropy engines')
+        self.engine = engine
+        self.var = np.asarray(var, dtype=float)
+        self.in_set = np.zeros(len(self.var), dtype=bool)
+        self.indices = []
+        self.value = 0.0
+        # (number of locations, size of the factor, value) before every push
+        self.stack = []
+
+        # cholesky factor of the (extra) measurements conditioned on the sampled set
+        self.ent_L = np.zeros((capacity, capacity))
+        self.ent_loc = np.zeros(capacity, dtype=int)
+        self.ent_size = 0
+        # rows of the covariance conditioned on the sampled set (only for the locations which have been pushed)
+        self._cond_rows = np.zeros((capacity, len(self.var)))
+        self._cond_position = np.full(len(self.var), -1)
+        self._num_cond_rows = 0
+        self._singleton_gains = None
+
+    @staticmethod
+    def _grow(x, size):
+        if size <= len(x):
+            return x
+        new_shape = [max(size, 2*len(x))] * x.ndim
+        y = np.zeros(new_shape, dtype=x.dtype)
+        y[tuple(slice(0, n) for n in x.shape)] = x
+        return y
+
+    def _conditional_rows(self, loc):
+        missing = loc[self._cond_position[loc] == -1]
+        if len(missing) > 0:
+            r = self._num_cond_rows
+            if r + len(missing) > len(self._cond_rows):
+                rows = np.zeros((max(r + len(missing), 2*len(self._cond_rows)), len(self.var)))
+                rows[:r] = self._cond_rows[:r]
+                self._cond_rows = rows
+            cross = self.engine.cross
+            self._cond_rows[r:r+len(missing)] = self.engine.cov_matrix[missing] - np.dot(cross[:, missing].T, cross)
+            self._cond_position[missing] = r + np.arange(len(missing))
+            self._num_cond_rows += len(missing)
+        return self._cond_rows[self._cond_position[loc]]
+
+    @staticmethod
+    def _append_cholesky(L, k, cov_bk, cov_bb):
+        # L[:k, :k] is the factor of the current set, the block b has covariance cov_bb and cross covariance cov_bk
+        if k > 0:
+            w = solve_triangular(L[:k, :k], cov_bk.T, lower=True, check_finite=False)
+            L[k:k+len(cov_bb), :k] = w.T
+            cov_bb = cov_bb - np.dot(w.T, w)
+        L_bb = np.linalg.cholesky(cov_bb)
+        L[k:k+len(cov_bb), k:k+len(cov_bb)] = L_bb
+        return np.sum(np.log(np.diag(L_bb)))
+
+    def push(self, indices):
+        # add indices (duplicates and locations already in the set are ignored) and return the new value
+        indices = np.unique(np.asarray(indices, dtype=int))
+        indices = indices[~self.in_set[indices]]
+        self.stack.append((len(self.indices), self.ent_size, self.value))
+        if len(indices) == 0:
+            return self.value
+        self.in_set[indices] = True
+        self.indices.extend(indices)
+
+        ind_new, var_new, ind_chg, delta_chg = self.engine._split(indices, self.var[indices])
+        if len(ind_new) + len(ind_chg) == 0:
+            return self.value
+        if np.any(delta_chg > 0):
+            raise ValueError('Noise variance of a sampled location can only be reduced')
+
+        # new measurements and extra measurements at the changed locations
+        noise_chg = self.engine.noise_var[ind_chg]
+        var_extra = 1.0 / (1.0 / self.var[ind_chg] - 1.0 / noise_chg)
+        loc = np.concatenate([ind_new, ind_chg])
+        m, k = len(loc), self.ent_size
+        self.ent_L = self._grow(self.ent_L, k + m)
+        self.ent_loc = self._grow(self.ent_loc, k + m)
+        rows = self._conditional_rows(loc)
+        cov_bk = rows[:, self.ent_loc[:k]]
+        cov_bb = rows[:, loc] + np.diag(np.concatenate([var_new, var_extra]))
+        self.value += m * CONST + self._append_cholesky(self.ent_L, k, cov_bk, cov_bb)
+        self.value -= len(ind_chg) * CONST + .5 * np.sum(np.log(noise_chg + var_extra))
+        self.ent_loc[k:k+m] = loc
+        self.ent_size += m
+        return self.value
+
+    def pop(self):
+        # undo the last push
+        num_indices, self.ent_size, self.value = self.stack.pop()
+        self.in_set[self.indices[num_indices:]] = False
+        del self.indices[num_indices:]
+
+    @property
+    def singleton_gains(self):
+        # gain of each location on its own (the engine state doesn't change while searching)
+        if self._singleton_gains is None:
+            self._singleton_gains = self.engine.gains(np.arange(len(self.var)), self.var)
+        return self._singleton_gains
+
+
+class KernelCache(object):
+    # kernel over a fixed set of points (e.g. field locations followed by test locations)
+    # the joint kernel is computed once per version of the gp hyperparameters and subsets are answered by
+    # index slicing; the signature mirrors GPR.cov_mat with index arrays in place of inputs
+    def __init__(self, gp, x):
+        super(KernelCache, self).__init__()
+        self.gp = gp
+        self.x = x
+        self.version = None
+        self._cov = None
+
+    @property
+    def cov(self):
+        if self.version != self.gp.version:
+            self._cov = self.gp.cov_mat(x1=self.x)
+            self.version = self.gp.version
+        return self._cov
+
+    def __call__(self, x1, x2=None, white_noise_var=None, add_likelihood_var=False):
+        x1 = np.asarray(x1)
+        x2 = None if x2 is None else np.asarray(x2)
+        if x1.ndim != 1 or (x2 is not None and x2.ndim != 1):
+            # raw inputs which are not part of the cached points
+            x1 = self.x[x1] if x1.ndim == 1 else x1
+            x2 = self.x[x2] if x2 is not None and x2.ndim == 1 else x2
+            return self.gp.cov_mat(x1, x2, white_noise_var=white_noise_var, add_likelihood_var=add_likelihood_var)
+
+        x1 = x1.astype(int)
+        if x2 is None:
+            cov = self.cov[np.ix_(x1, x1)]
+        else:
+            cov = self.cov[np.ix_(x1, x2.astype(int))]
+
+        if white_noise_var is not None:
+            cov += np.diag(white_noise_var)
+        if add_likelihood_var:
+            cov += self.gp.likelihood_var * np.eye(len(cov))
+        return cov
+
+
+class GPPosterior(object):
+    # posterior of a gp model conditioned on noisy measurements
+    # training points are identified by keys (e.g. gp indices) and the cholesky factor of the training
+    # covariance is extended with block updates as new points arrive instead of being refactorized
+    # kernel is either GPR.cov_mat (points are inputs) or a KernelCache (points are indices)
+    def __init__(self, kernel):
+        super(GPPosterior, self).__init__()
+        self.kernel = kernel
+        self.reset()
+
+    def reset(self):
+        # call whenever the hyperparameters of the gp model change
+        self.keys = []
+        self.position = {}
+        self.x = None
+        self.y = np.zeros(0)
+        self.var = np.zeros(0)
+        self.L = np.zeros((0, 0))
+
+    @property
+    def size(self):
+        return len(self.keys)
+
+    def update(self, keys, x, y, var):
+        # set the training data; only new keys and keys with a different noise variance touch the factor
+        keys = list(keys)
+        if len(set(self.keys) - set(keys)) > 0:
+            # some training points have been removed
+            self.reset()
+
+        x = np.asarray(x)
+        y = np.asarray(y, dtype=float)
+        var = np.asarray(var, dtype=float)
+        pos = np.array([self.position.get(key, -1) for key in keys], dtype=int)
+
+        # existing points with a different noise variance: rank-one changes of the factor
+        for i in np.where(pos != -1)[0]:
+            delta = var[i] - self.var[pos[i]]
+            if delta != 0:
+                v = np.zeros(self.size)
+                v[pos[i]] = np.sqrt(abs(delta))
+                cholesky_update(self.L, v, downdate=delta < 0)
+                self.var[pos[i]] = var[i]
+
+        # new points: block update of the factor
+        new = np.where(pos == -1)[0]
+        if len(new) > 0:
+            m = self.size
+            x_new = x[new]
+            cov_nn = self.kernel(x_new, white_noise_var=var[new], add_likelihood_var=True)
+            L = np.zeros((m + len(new), m + len(new)))
+            L[:m, :m] = self.L
+            if m > 0:
+                w = solve_triangular(self.L, self.kernel(self.x, x_new), lower=True)
+                L[m:, :m] = w.T
+                cov_nn = cov_nn - np.dot(w.T, w)
+            L[m:, m:] = np.linalg.cholesky(cov_nn)
+            self.L = L
+            self.x = x_new if m == 0 else np.concatenate([self.x, x_new], axis=0)
+            self.var = np.concatenate([self.var, var[new]])
+            for i in new:
+                self.position[keys[i]] = len(self.keys)
+                self.keys.append(keys[i])
+
+        # measurements can change without changing the factor
+        self.y = np.zeros(self.size)
+        self.y[[self.position[key] for key in keys]] = y
+
+    def predict(self, x, test_var=None, return_var=False, return_cov=False, return_mi=False):
+        # same outputs as utils.predictive_distribution
+        y_mean = np.mean(self.y)
+        cov_ax = self.kernel(self.x, x)
+        w = solve_triangular(self.L, cov_ax, lower=True)
+        alpha = solve_triangular(self.L, self.y - y_mean, lower=True)
+        mu = np.dot(w.T, alpha) + y_mean
+        if not (return_var or return_cov or return_mi):
+            return mu
+
+        cov_xx = self.kernel(x, white_noise_var=test_var)
+        cov = cov_xx - np.dot(w.T, w)
+
+        if return_var:
+            res = (mu, np.diag(cov))
+
+        if return_cov:
+            res = (mu, cov)
+
+        if return_mi:
+            mi = entropy_from_cov(cov_xx) - entropy_from_cov(cov)
+            res = (mu, mi)
+
+        if return_cov and return_mi:
+            res = (mu, cov, mi)
+        return res
+
+
+def batched_set_gains(engine, indices_list, var_list, max_batch_elements=2**22):
+    # joint gains of many sets of locations (e.g. mobile samples along candidate paths)
+    # sets are grouped by their number of new and changed locations and evaluated with stacked determinants
+    num_sets = len(indices_list)
+    source = np.arange(num_sets)
+    first_seen = {}
+    groups = {}
+    for i in range(num_sets):
+        indices = np.asarray(indices_list[i], dtype=int)
+        var = np.asarray(var_list[i], dtype=float)
+        # identical sets share a single evaluation (and hence the exact same utility)
+        key = (indices.tobytes(), var.tobytes())
+        if key in first_seen:
+            source[i] = first_seen[key]
+            continue
+        first_seen[key] = i
+        split = engine._split(indices, var)
+        groups.setdefault((len(split[0]), len(split[2])), []).append((i, split))
+
+    gains = np.zeros(num_sets)
+    for (s, c), members in groups.items():
+        # bound the memory of the stacked (batch, size, s + c) factors
+        batch_size = max(1, max_batch_elements // max(1, (engine.size + s + c) * (s + c)))
+        for start in range(0, len(members), batch_size):
+            chunk = members[start:start+batch_size]
+            stacked = [np.array([split[k] for _, split in chunk]) for k in range(4)]
+            stacked[0] = stacked[0].astype(int)
+            stacked[2] = stacked[2].astype(int)
+            gains[[i for i, _ in chunk]] = engine._batch_gain(*stacked)
+    return gains[source]
+
+
+# engines of the worker processes by version of the engine arrays (see SetGainsPool)
+_worker_engine = None
+_worker_version = None
+
+
+def _worker_set_gains(args):
+    global _worker_engine, _worker_version
+    version, engine_cls, filenames, indices_list, var_list = args
+    if version != _worker_version:
+        state = {key: np.load(fn, mmap_mode='r') for key, fn in filenames.items()}
+        _worker_engine = engine_cls._from_state(state)
+        _worker_version = version
+    return batched_set_gains(_worker_engine, indices_list, var_list)
+
+
+class SetGainsPool(object):
+    # persistent pool of worker processes evaluating set gains
+    # the engine arrays (cov_matrix, factors, precisions) are written to memory-mapped files which the workers map
+    # read-only, and they are only written again for a different (or updated) engine, the covariance only when
+    # the engine holds a different covariance (e.g. after the gp model is updated)
+    def __init__(self, num_workers):
+        super(SetGainsPool, self).__init__()
+        self.num_workers = num_workers
+        self.pool = multiprocessing.Pool(num_workers)
+        self.tmp_dir = tempfile.mkdtemp(prefix='set_gains_')
+        # (array, filename) of each key of the engine state
+        self.arrays = dict()
+        self.engine = None
+        self.num_updates = None
+        self.version = 0
+
+    def _write(self, engine):
+        # files of the engine arrays, written only if the engine arrays changed since the last call
+        if engine is self.engine and engine.num_updates == self.num_updates:
+            return {key: fn for key, (_, fn) in self.arrays.items()}
+        self.version += 1
+        state = engine._state()
+        for key in [k for k in self.arrays if k not in state]:
+            os.remove(self.arrays.pop(key)[1])
+        for key, val in state.items():
+            # engines never modify the covariance
+            if key.endswith('cov_matrix') and key in self.arrays and self.arrays[key][0] is val:
+                continue
+            filename = os.path.join(self.tmp_dir, '{}_{}.npy'.format(key, self.version))
+            np.save(filename, np.asarray(val))
+            if key in self.arrays:
+                # workers which still map the old file keep it until they load the new version
+                os.remove(self.arrays[key][1])
+            self.arrays[key] = (val, filename)
+        self.engine = engine
+        self.num_updates = engine.num_updates
+        return {key: fn for key, (_, fn) in self.arrays.items()}
+
+    def map(self, engine, tasks):
+        filenames = self._write(engine)
+        return self.pool.map(_worker_set_gains, [(self.version, type(engine), filenames) + task for task in tasks])
+
+    def close(self):
+        self.pool.terminate()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+# pools shared by all the calls of parallel_set_gains (by number of workers)
+_set_gains_pools = dict()
+
+
+@atexit.register
+def _close_set_gains_pools():
+    for pool in _set_gains_pools.values():
+        pool.close()
+    _set_gains_pools.clear()
+
+
+def parallel_set_gains(engine, indices_list, var_list, num_workers, chunks_per_worker=4):
+    # same as engine.set_gains but spread over a persistent pool of processes (see SetGainsPool)
+    num_sets = len(indices_list)
+    source = np.arange(num_sets)
+    first_seen = {}
+    unique = []
+    for i in range(num_sets):
+        key = (np.asarray(indices_list[i], dtype=int).tobytes(), np.asarray(var_list[i], dtype=float).tobytes())
+        if key not in first_seen:
+            first_seen[key] = len(unique)
+            unique.append(i)
+        source[i] = first_seen[key]
+
+    # fixed contiguous chunks and an ordered map make the result deterministic
+    num_chunks = min(len(unique), num_workers * chunks_per_worker)
+    chunks = [c for c in np.array_split(np.array(unique, dtype=int), max(1, num_chunks)) if len(c) > 0]
+    tasks = [([indices_list[i] for i in c], [var_list[i] for i in c]) for c in chunks]
+
+    if num_workers not in _set_gains_pools:
+        _set_gains_pools[num_workers] = SetGainsPool(num_workers)
+    results = _set_gains_pools[num_workers].map(engine, tasks)
+
+    gains = np.concatenate(results) if len(results) > 0 else np.zeros(0)
+    return gains[source]
+
+
+def standard_greedy(engine, candidates, var, num_samples):
+    # re-evaluate the gain of every remaining candidate in each step
+    candidates = np.array(candidates)
+    var = np.array(var, dtype=float)
+    selected = []
+    for _ in range(num_samples):
+        utilities = engine.gains(candidates, var)
+        best = np.argmax(utilities)
+        selected.append(candidates[best])
+        engine.add(candidates[best], var[best])
+        candidates = np.delete(candidates, best)
+        var = np.delete(var, best)
+    return selected
+
+
+def lazy_greedy(engine, candidates, var, num_samples):
+    # gains can only shrink as the sampled set grows (submodularity), so a stale gain is an upper bound
+    # re-evaluate the top candidate of the priority queue until it stays on top
+    # mutual information is not submodular, so only entropy engines are supported
+    if isinstance(engine, IncrementalMutualInformation):
+        raise ValueError('lazy greedy needs a submodular gain, use standard greedy with mutual information')
+    var = np.asarray(var, dtype=float)
+    utilities = engine.gains(candidates, var)
+    # entries are (-upper bound, candidate index, step in which the bound was computed)
+    heap = [(-utilities[i], i, 0) for i in range(len(candidates))]
+    heapq.heapify(heap)
+
+    selected = []
+    for step in range(num_samples):
+        while True:
+            _, i, computed_at = heapq.heappop(heap)
+            if computed_at == step:
+                break
+            ut = engine.gains([candidates[i]], var[[i]])[0]
+            heapq.heappush(heap, (-ut, i, step))
+        selected.append(candidates[i])
+        engine.add(candidates[i], var[i])
+    return selected
+
+
+def stochastic_greedy(engine, candidates, var, num_samples, epsilon=.1):
+    # evaluate only a random subset of size (n/k)*log(1/epsilon) of the remaining candidates in each step
+    if not 0 < epsilon < 1:
+        raise ValueError('epsilon of stochastic greedy must be in (0, 1)')
+    candidates = np.array(candidates)
+    var = np.array(var, dtype=float)
+    subset_size = max(1, int(np.ceil(len(candidates) / num_samples * np.log(1.0 / epsilon))))
+    selected = []
+    for _ in range(num_samples):
+        subset = np.random.permutation(len(candidates))[:subset_size]
+        utilities = engine.gains(candidates[subset], var[subset])
+        best = subset[np.argmax(utilities)]
+        selected.append(candidates[best])
+        engine.add(candidates[best], var[best])
+        candidates = np.delete(candidates, best)
+        var = np.delete(var, best)
+    return selected
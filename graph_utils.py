@@ -25,26 +25,24 @@ def get_heading(node, next_node):
         return (diff[0]//abs(diff[0]),0)
 
 
-def get_down_and_up_nodes(node, others, down_junction, up_junction):
-    # find nodes just above and below the current node
-    down_node, up_node = down_junction, up_junction
-    for nd in others:
-        if nd == node:
-            continue
-        if in_between(nd, down_node, node):
-            down_node = nd
-        if in_between(nd, node, up_node):
-            up_node = nd
-    return down_node, up_node
-
-
-def in_between(node, down_node, up_node):
-    # check if node lies between down and up
-    if node[1] == down_node[1] and node[1] == up_node[1]:
-        if down_node[0] > node[0] > up_node[0]:
-            return True
-    return False
-    
+def get_all_down_and_up_nodes(nodes, down_junctions, up_junctions):
+    # nearest nodes (or junctions) below and above each node in the same column, among the nodes themselves
+    nodes = np.asarray(nodes).reshape(-1, 2)
+    down_junctions = np.asarray(down_junctions).reshape(-1, 2)
+    up_junctions = np.asarray(up_junctions).reshape(-1, 2)
+    # sort nodes by column and then row, nearest nodes in the same column are adjacent
+    num_rows = max(nodes[:, 0].max(), down_junctions[:, 0].max()) + 1
+    keys = nodes[:, 1] * num_rows + nodes[:, 0]
+    sorted_keys = np.append(np.unique(keys), -1)
+    next_keys = sorted_keys[np.searchsorted(sorted_keys[:-1], keys, side='right')]
+    prev_keys = sorted_keys[np.searchsorted(sorted_keys[:-1], keys, side='left') - 1]
+    # the nodes must be in the same column and between the node and the junction
+    use_next = (next_keys // num_rows == nodes[:, 1]) & (next_keys % num_rows < down_junctions[:, 0])
+    use_prev = (prev_keys >= 0) & (prev_keys // num_rows == nodes[:, 1]) & (prev_keys % num_rows > up_junctions[:, 0])
+    down_nodes = [(int(k % num_rows), int(k // num_rows)) if use else tuple(j) for k, use, j in zip(next_keys, use_next, down_junctions)]
+    up_nodes = [(int(k % num_rows), int(k // num_rows)) if use else tuple(j) for k, use, j in zip(prev_keys, use_prev, up_junctions)]
+    return down_nodes, up_nodes
+
 
 def lower_bound_path_cost(pose, waypoints):
     # return minimum cost of traversal to all the unvisited waypoints
@@ -63,6 +61,45 @@ def lower_bound_path_cost(pose, waypoints):
     return dist
 
 
+class PathCostLowerBound(object):
+    # admissible lower bound on the cost of visiting all the unvisited waypoints (visited is a bitmask)
+    # max of the bounding box bound, distance to the farthest waypoint and
+    # distance to the nearest waypoint + minimum spanning tree over the unvisited waypoints
+    def __init__(self, map, waypoints):
+        super(PathCostLowerBound, self).__init__()
+        self.map = map
+        self.waypoints = waypoints
+        self.all_visited = (1 << len(waypoints)) - 1
+        self.pairwise = map.pairwise_corridor_distance(waypoints, waypoints)
+        # spanning tree cost for each set of unvisited waypoints
+        self._spanning_tree_cost = dict()
+
+    def spanning_tree_cost(self, remaining):
+        if remaining not in self._spanning_tree_cost:
+            ind = [i for i in range(len(self.waypoints)) if (remaining >> i) & 1]
+            # prim's algorithm
+            dist = self.pairwise[ind[0], ind]
+            in_tree = np.full(len(ind), False)
+            in_tree[0] = True
+            cost = 0
+            for _ in range(len(ind) - 1):
+                j = np.argmin(np.where(in_tree, np.inf, dist))
+                cost += dist[j]
+                in_tree[j] = True
+                dist = np.minimum(dist, self.pairwise[ind[j], ind])
+            self._spanning_tree_cost[remaining] = cost
+        return self._spanning_tree_cost[remaining]
+
+    def __call__(self, pose, heading, visited):
+        remaining = self.all_visited & ~visited
+        if remaining == 0:
+            return 0
+        waypoints = [w for i, w in enumerate(self.waypoints) if (remaining >> i) & 1]
+        dists = [self.map.distance_between_nodes(pose, w, heading)[0] for w in waypoints]
+        bound = max(min(dists) + self.spanning_tree_cost(remaining), max(dists))
+        return max(bound, lower_bound_path_cost(pose, waypoints))
+
+
 def opposite_headings(h0, h1):
     # headings should be one from {(0,1), (0,-1), (1,0), (1,-1)}
     temp = h0[0]*h1[0] + h0[1]*h1[1]
@@ -125,11 +162,185 @@ def path_cost(path):
     return cost
 
 
-def find_merge_to_node(tree, node):
-    # all nodes in the graph with same attributes as node
-    all_nodes = [n for n in tree.nodes() if tree.node[n]==node]
-    # if len(all_nodes) > 1:
-    #     ipdb.set_trace()
-    if len(all_nodes) > 0:
-        return all_nodes[0]
-    return None   
\ No newline at end of file
+class GraphOverlay(object):
+    # nodes and edges added to or removed from a base graph without modifying it
+    # adjacency of the touched nodes is copied from the base graph on first modification
+    # the adjacency dicts of the base graph are read directly (networkx builds a new view on every graph.adj access)
+    def __init__(self, base):
+        super(GraphOverlay, self).__init__()
+        self.base = base
+        self._adj = dict()
+        self._node_attrs = dict()
+
+    def _touch(self, node):
+        if node not in self._adj:
+            self._adj[node] = dict(self.base._adj[node]) if node in self.base else dict()
+        return self._adj[node]
+
+    def __contains__(self, node):
+        return node in self._adj or node in self.base
+
+    def add_node(self, node, **attr):
+        self._touch(node)
+        self._node_attrs[node] = attr
+
+    def add_edge(self, u, v, **attr):
+        self._touch(u)[v] = attr
+        self._touch(v)[u] = attr
+
+    def remove_edges_from(self, edges):
+        # missing edges are ignored (same as networkx)
+        for u, v in edges:
+            if v in self._touch(u):
+                del self._adj[u][v]
+                del self._touch(v)[u]
+
+    def neighbors(self, node):
+        adj = self._adj.get(node)
+        return iter(self.base._adj[node] if adj is None else adj)
+
+    def get_edge_data(self, u, v, default=None):
+        adj = self._adj.get(u)
+        return (self.base._adj[u] if adj is None else adj).get(v, default)
+
+    def diff(self):
+        # adjacency and attributes of the touched nodes (the overlay without its base graph)
+        return self._adj, self._node_attrs
+
+    @classmethod
+    def from_diff(cls, base, diff):
+        overlay = cls(base)
+        overlay._adj, overlay._node_attrs = diff
+        return overlay
+
+
+class SearchStateIndex(object):
+    # hash map from a search state (pose, heading, visited, gval) to the index of the tree node with that state
+    def __init__(self):
+        super(SearchStateIndex, self).__init__()
+        self._index = dict()
+
+    def add(self, state, idx):
+        # the first tree node with a given state is the one other nodes are merged to
+        self._index.setdefault(state, idx)
+
+    def find(self, state):
+        return self._index.get(state)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class SearchTree(object):
+    # expansion tree stored as parallel lists indexed by node id (root is 0)
+    # visited waypoints are encoded as a bitmask, bit i is set if the i^{th} waypoint has been visited
+    # nodes reached from more than one parent (merged search states) keep the extra parents separately
+    def __init__(self):
+        super(SearchTree, self).__init__()
+        self.pose = []
+        self.heading = []
+        self.visited = []
+        self.gval = []
+        self.parent = []
+        self.merged_parents = dict()
+        self.state_index = SearchStateIndex()
+
+    def __len__(self):
+        return len(self.pose)
+
+    def add_node(self, pose, heading, visited, gval, parent=-1):
+        idx = len(self.pose)
+        self.pose.append(pose)
+        self.heading.append(heading)
+        self.visited.append(visited)
+        self.gval.append(gval)
+        self.parent.append(parent)
+        self.state_index.add((pose, heading, visited, gval), idx)
+        return idx
+
+    def find(self, pose, heading, visited, gval):
+        # index of an existing node with the same search state
+        return self.state_index.find((pose, heading, visited, gval))
+
+    def add_parent(self, idx, parent):
+        self.merged_parents.setdefault(idx, []).append(parent)
+
+    def parents(self, idx):
+        if self.parent[idx] == -1:
+            return []
+        return [self.parent[idx]] + self.merged_parents.get(idx, [])
+
+    def children(self):
+        # children of every node (including the nodes merged into them)
+        children = [[] for _ in range(len(self))]
+        for idx in range(len(self)):
+            for p in self.parents(idx):
+                children[p].append(idx)
+        return children
+
+    def paths_to(self, idx):
+        # generate all paths (list of node ids) from the root to idx
+        # merged nodes share the same gval so all of these paths have the same cost
+        stack = [(idx, [idx])]
+        while len(stack) > 0:
+            node, reversed_path = stack.pop()
+            parents = self.parents(node)
+            if len(parents) == 0:
+                yield reversed_path[::-1]
+                continue
+            for p in reversed(parents):
+                stack.append((p, reversed_path + [p]))
+
+
+class DominatedParentFilter(object):
+    # merges parents into the nodes of a SearchTree during the expansion, except for parents all of whose paths are
+    # dominated by the first path to the node (same cost and completions, covering only gp indices it covers)
+    # gp indices are bitsets (python ints): covered by the first path to each node and by any of its paths
+    # a parent can still get new paths after a merge is dropped, the coverage of its descendants then grows and
+    # dropped merges that are no longer dominated are added back, so no undominated path is lost
+    def __init__(self, tree):
+        super(DominatedParentFilter, self).__init__()
+        self.tree = tree
+        self.first_covered = []
+        self.any_covered = []
+        self.children = []
+        # parent -> [(node, gp indices covered by the edge)] of the dropped merges
+        self.dropped = dict()
+
+    def add_node(self, idx, parent=-1, edge_covered=0):
+        # called for every node added to the tree (children after their parents)
+        first, any_ = (0, 0) if parent == -1 else (self.first_covered[parent], self.any_covered[parent])
+        self.first_covered.append(first | edge_covered)
+        self.any_covered.append(any_ | edge_covered)
+        self.children.append([])
+        if parent != -1:
+            self.children[parent].append((idx, edge_covered))
+
+    def merge(self, idx, parent, edge_covered):
+        # merge parent into idx unless all its paths are dominated, returns True if merged
+        covered = self.any_covered[parent] | edge_covered
+        if covered & ~self.first_covered[idx] == 0:
+            self.dropped.setdefault(parent, []).append((idx, edge_covered))
+            return False
+        self._add_parent(idx, parent, edge_covered)
+        return True
+
+    def _add_parent(self, idx, parent, edge_covered):
+        self.tree.add_parent(idx, parent)
+        self.children[parent].append((idx, edge_covered))
+        stack = [(idx, self.any_covered[parent] | edge_covered)]
+        while len(stack) > 0:
+            node, covered = stack.pop()
+            new = covered & ~self.any_covered[node]
+            if new == 0:
+                continue
+            self.any_covered[node] |= new
+            for child, _ in self.children[node]:
+                stack.append((child, new))
+            dropped = self.dropped.get(node, [])
+            for child, child_edge_covered in list(dropped):
+                if (self.any_covered[node] | child_edge_covered) & ~self.first_covered[child] != 0:
+                    dropped.remove((child, child_edge_covered))
+                    self.tree.add_parent(child, node)
+                    self.children[node].append((child, child_edge_covered))
+                    stack.append((child, self.any_covered[node] | child_edge_covered))
@@ -1,11 +1,18 @@
+import os
 import numpy as np
 from utils import manhattan_distance
 from graph_utils import get_heading, opposite_headings
 import ipdb
 
 
+HEADINGS = [(1,0), (-1,0), (0,1), (0,-1)]
+HEADING_INDEX = {h: i for i, h in enumerate(HEADINGS)}
+# precomputed distance tables shared by all maps with the same layout
+_distance_tables = dict()
+
+
 class Map(object):
-    def __init__(self, num_gp_rows=15, num_gp_cols=37, num_row_passes=2, row_pass_width=1):
+    def __init__(self, num_gp_rows=15, num_gp_cols=37, num_row_passes=2, row_pass_width=1, max_cache_size=2**20):
 
         super(Map, self).__init__()
         
@@ -19,16 +26,30 @@ class Map(object):
         self._shape = self._compute_map_dimensions()
         self.corridor_len = self.num_gp_rows // (self.num_row_passes + 1)
         self.row_pass_indices = self._get_row_pass_indices()
+        # nearest junction row above (up) and below (down) each row
+        rows = np.arange(self._shape[0])
+        self.up_junction_rows = self.row_pass_indices[np.searchsorted(self.row_pass_indices, rows, side='right') - 1]
+        self.down_junction_rows = self.row_pass_indices[np.searchsorted(self.row_pass_indices, rows, side='left')]
         self.free_cols = np.arange(0, self.shape[1], 2)
         self.obstacle_cols = np.arange(1, self.shape[1], 2)
 
         # 1 if obstacle 0 otherwise
         self.occupied = self._set_occupancy_grid()
 
+        # distance and final heading for all (start, heading, goal) in free columns (see precompute_distances)
+        self._distance_table = None
+        # memoized distances when the table is not precomputed (cleared when full)
+        self._distance_cache = dict()
+        self.max_cache_size = max_cache_size
+
     @property
     def shape(self):
         return self._shape
 
+    @property
+    def layout(self):
+        return self.num_gp_rows, self.num_gp_cols, self.num_row_passes, self.row_pass_width
+
     def _set_occupancy_grid(self):
         # returns the occupancy grid of the map
         grid = np.full(self._shape, False)
@@ -58,6 +79,21 @@ class Map(object):
         if start == goal:
             return 0, heading
 
+        if self._distance_table is not None and start[1] % 2 == 0 and goal[1] % 2 == 0:
+            dist, final_heading = self._distance_table
+            key = (start[0], start[1]//2, HEADING_INDEX[heading], goal[0], goal[1]//2)
+            if dist[key] >= 0:
+                return int(dist[key]), HEADINGS[final_heading[key]]
+
+        key = (start, goal, heading)
+        if key not in self._distance_cache:
+            if len(self._distance_cache) >= self.max_cache_size:
+                self._distance_cache.clear()
+            self._distance_cache[key] = self._distance_between_nodes(start, goal, heading)
+        return self._distance_cache[key]
+
+    def _distance_between_nodes(self, start, goal, heading):
+
         # these cases should never occur
         if start[0] not in self.row_pass_indices and heading not in [(1,0),(-1,0)]:
             raise NotImplementedError('Starting location has infeasible heading')
@@ -126,6 +162,76 @@ class Map(object):
                         final_heading = get_heading((start[0], goal[1]), goal)
                     return total_dist, final_heading
 
+    def precompute_distances(self, filename=None):
+        # precompute distance_between_nodes for all cells in free columns and all headings
+        # the table is loaded from filename if it exists, otherwise it is saved there after computing
+        if self.layout not in _distance_tables:
+            if filename is not None and os.path.exists(filename):
+                data = np.load(filename)
+                if tuple(data['layout']) != self.layout:
+                    raise ValueError('Distance table in {} was computed for a different map layout'.format(filename))
+                _distance_tables[self.layout] = (data['dist'], data['final_heading'])
+            else:
+                _distance_tables[self.layout] = self._compute_distance_table()
+                if filename is not None:
+                    self.save_distances(filename)
+        self._distance_table = _distance_tables[self.layout]
+
+    def save_distances(self, filename):
+        dist, final_heading = _distance_tables[self.layout] if self._distance_table is None else self._distance_table
+        np.savez_compressed(filename, layout=np.array(self.layout), dist=dist, final_heading=final_heading)
+
+    def _compute_distance_table(self):
+        # vectorized version of _distance_between_nodes
+        # tables are indexed by (start row, start column // 2, heading index, goal row, goal column // 2)
+        # -1 marks the settings distance_between_nodes does not handle (goal is a junction, etc)
+        rows = np.arange(self.shape[0])
+        up = self.up_junction_rows
+        down = self.down_junction_rows
+        is_junction = np.isin(rows, self.row_pass_indices)
+        sx, sy, gx, gy = np.meshgrid(rows, self.free_cols, rows, self.free_cols, indexing='ij')
+        dx = gx - sx
+        dy = np.abs(gy - sy)
+        sgn = np.sign(dx)
+        same_col = sy == gy
+
+        nr, nc = len(rows), len(self.free_cols)
+        dist = np.full((nr, nc, len(HEADINGS), nr, nc), -1, dtype=np.int16)
+        final_heading = np.zeros((nr, nc, len(HEADINGS), nr, nc), dtype=np.int8)
+        for k, heading in enumerate(HEADINGS):
+            if heading[1] == 0:
+                # junctions in the heading direction (and the opposite direction)
+                sj = down[sx] if heading[0] == 1 else up[sx]
+                gj = down[gx] if heading[0] == 1 else up[gx]
+                gj_back = up[gx] if heading[0] == 1 else down[gx]
+                # same column: move directly if the heading aligns, otherwise detour through the adjacent column
+                aligned = sgn != -heading[0]
+                d_same = np.where(aligned, np.abs(dx),
+                                  np.abs(sx - sj) + 4 + np.where(sj != gj, np.abs(sj - gx), np.abs(sj - gj_back) + np.abs(gj_back - gx)))
+                h_same = np.where(aligned, sgn, np.where(sj != gj, -heading[0], heading[0]))
+                # different columns: move to the junction and then proceed to the goal
+                d_diff = np.abs(sx - sj) + np.abs(sj - gx) + dy
+                h_diff = np.where(gx == sj, heading[0], np.sign(gx - sj))
+                valid = ~is_junction[gx]
+            else:
+                d_same = np.abs(dx)
+                h_same = sgn
+                # different columns: move there directly if heading points towards the goal, else through a junction
+                towards = ((gy >= sy) & (heading[1] > 0)) | ((gy <= sy) & (heading[1] < 0))
+                gu, gd = up[gx], down[gx]
+                d_diff = np.where(towards, np.abs(dx) + dy,
+                         np.where(sx == gu, np.abs(sx - gd) + dy + np.abs(gd - gx),
+                         np.where(sx == gd, np.abs(sx - gu) + dy + np.abs(gu - gx), np.abs(dx) + dy)))
+                h_diff = np.where(towards, sgn, np.where(sx == gu, -1, np.where(sx == gd, 1, sgn)))
+                # start must be a junction
+                valid = ~is_junction[gx] & is_junction[sx]
+            d = np.where(same_col, d_same, d_diff)
+            hx = np.where(same_col, h_same, h_diff)
+            dist[:, :, k] = np.where(valid, d, -1)
+            # final headings are always along the columns
+            final_heading[:, :, k] = np.where(hx > 0, HEADING_INDEX[(1,0)], HEADING_INDEX[(-1,0)])
+        return dist, final_heading
+
     def distance_between_nodes_with_headings(self, start, start_heading, goal, goal_heading):
         dist, final_heading = self.distance_between_nodes(start, goal, start_heading)
         if not opposite_headings(final_heading, goal_heading):
@@ -168,6 +274,23 @@ class Map(object):
 
         return min_dist + extra
 
+    def corridor_distance(self, node0, node1):
+        # lower bound on the distance between two nodes irrespective of headings
+        # robot can only change columns along the row passes (through the junctions above or below a node)
+        return int(self.pairwise_corridor_distance([node0], [node1])[0, 0])
+
+    def pairwise_corridor_distance(self, nodes0, nodes1):
+        # corridor_distance between all pairs of nodes0 and nodes1
+        nodes0 = np.asarray(nodes0).reshape(-1, 2)[:, np.newaxis, :]
+        nodes1 = np.asarray(nodes1).reshape(-1, 2)[np.newaxis, :, :]
+        x0, y0, x1, y1 = nodes0[..., 0], nodes0[..., 1], nodes1[..., 0], nodes1[..., 1]
+        all_dists = []
+        for junc0 in [self.up_junction_rows[x0], self.down_junction_rows[x0]]:
+            for junc1 in [self.up_junction_rows[x1], self.down_junction_rows[x1]]:
+                all_dists.append(np.abs(x0 - junc0) + np.abs(junc0 - junc1) + np.abs(junc1 - x1))
+        dist = np.min(all_dists, axis=0) + np.abs(y0 - y1)
+        return np.where(y0 == y1, np.abs(x0 - x1), dist)
+
     def get_junction(self, pose, heading):
         # return junction in the heading direction
         if heading == (1,0):
@@ -179,13 +302,21 @@ class Map(object):
             
     def get_up_junction(self, pose):
         # return up junction (in decreasing x direction)
-        up = max([x for x in self.row_pass_indices if x<=pose[0]])
-        return (up, pose[1])
+        return (self.up_junction_rows[pose[0]], pose[1])
 
     def get_down_junction(self, pose):
         # return down junction (in increasing x direction)
-        down = min([x for x in self.row_pass_indices if x>=pose[0]])
-        return (down, pose[1])
+        return (self.down_junction_rows[pose[0]], pose[1])
+
+    def get_up_junctions(self, poses):
+        # batch version of get_up_junction, poses is an array of shape (n, 2)
+        poses = np.asarray(poses).reshape(-1, 2)
+        return np.stack([self.up_junction_rows[poses[:, 0]], poses[:, 1]], axis=1)
+
+    def get_down_junctions(self, poses):
+        # batch version of get_down_junction
+        poses = np.asarray(poses).reshape(-1, 2)
+        return np.stack([self.down_junction_rows[poses[:, 0]], poses[:, 1]], axis=1)
 
     def nearest_waypoint_path_cost(self, start, start_heading, waypoints, return_seq=False):
         # return cost of the path formed by always moving to the nearest waypoint
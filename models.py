@@ -84,7 +84,10 @@ class NonLinearLatentFunction(nn.Module):
 
 
 class GPR(object):
-    def __init__(self, latent=None, lr=.01, max_iterations=200, kernel_params=None, latent_params=None, learn_likelihood_noise=True):
+    def __init__(self, latent=None, lr=.01, max_iterations=200, kernel_params=None, latent_params=None, learn_likelihood_noise=True,
+                 optimizer='adam', tol=1e-4, patience=10, warm_start=True):
+        if optimizer not in ['adam', 'lbfgs']:
+            raise ValueError('optimizer must be one of adam or lbfgs, got {}'.format(optimizer))
         self._train_x = None
         self._train_y = None
         self._train_y_mean = None
@@ -92,6 +95,7 @@ class GPR(object):
         self.likelihood = None
         self.model = None
         self.optimizer = None
+        self.lr_scheduler = None
         self.mll = None
         self.lr = lr
         self.latent = latent
@@ -99,6 +103,14 @@ class GPR(object):
         self.latent_params = latent_params
         self.max_iter = max_iterations
         self.learn_likelihood_noise = learn_likelihood_noise
+        self.optimizer_type = optimizer
+        # early stopping: relative improvement of the marginal log likelihood over patience iterations
+        self.tol = tol
+        self.patience = patience
+        # initialize hyperparameters from the previous fit when refitting
+        self.warm_start = warm_start
+        # incremented whenever the hyperparameters may have changed (used to invalidate kernel caches)
+        self.version = 0
 
     @property
     def train_x(self):
@@ -114,14 +126,28 @@ class GPR(object):
             return None
         return self._train_var.cpu().numpy()
 
+    @property
+    def likelihood_var(self):
+        return self.likelihood.log_noise.exp().item()
+
     def reset(self, x, y, var):
         self.set_train_data(x, y, var)
         # self.likelihood = GaussianLikelihood(learn_noise=self.learn_likelihood_noise)
         self.likelihood = GaussianLikelihood()
         self.model = ExactGPModel(self._train_x, self._zero_mean_train_y, self.likelihood, self._train_var, self.latent, self.kernel_params, self.latent_params)
-        self.optimizer = torch.optim.Adam([{'params': self.model.parameters()}, ], lr=self.lr)
+        if self.optimizer_type == 'lbfgs':
+            self.optimizer = torch.optim.LBFGS(self.model.parameters(), lr=1.0, max_iter=20, line_search_fn='strong_wolfe')
+            # LBFGS does its own line search, no learning rate schedule
+            self.lr_scheduler = None
+        else:
+            self.optimizer = torch.optim.Adam([{'params': self.model.parameters()}, ], lr=self.lr)
+            self.lr_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(self.optimizer, mode='min', patience=50, verbose=True)
         self.mll = gpytorch.mlls.ExactMarginalLogLikelihood(self.likelihood, self.model)
-        self.lr_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(self.optimizer, mode='min', patience=50, verbose=True)
+        self.version += 1
+
+    def load_state_dict(self, state_dict):
+        self.model.load_state_dict(state_dict)
+        self.version += 1
         
     def set_train_data(self, x, y, var=None):
         self._train_x = to_torch(x)
@@ -137,26 +163,55 @@ class GPR(object):
     def fit(self, x, y, var=None, disp=False):
         if var is None:
             var = np.full(len(y), 1e-5)
+        prev_params = None
+        if self.warm_start and self.model is not None:
+            prev_params = {name: p.detach().clone() for name, p in self.model.named_parameters()}
         self.reset(x, y, var)
+        if prev_params is not None:
+            self._load_parameters(prev_params)
         self.model.train()
         self.likelihood.train()
-        
-        losses = []
-        for i in range(self.max_iter):
+
+        def closure():
             self.optimizer.zero_grad()
             output = self.model(self._train_x)
             loss = -self.mll(output, self._zero_mean_train_y)
             loss.backward()
-            self.optimizer.step()
-            self.lr_scheduler.step(loss)
+            return loss
+        
+        losses = []
+        best_loss = np.inf
+        num_bad_iters = 0
+        for i in range(self.max_iter):
+            if self.optimizer_type == 'lbfgs':
+                loss = self.optimizer.step(closure)
+            else:
+                loss = closure()
+                self.optimizer.step()
+                self.lr_scheduler.step(loss)
             if disp:
                 print(i, loss.item())
-            if i == 0:
-                initial_ll = -loss.item()
-            elif i == self.max_iter - 1:
-                final_ll = -loss.item()
             losses.append(loss.item())
-        print('Initial LogLikelihood {:.3f} Final LogLikelihood {:.3f}'.format(initial_ll, final_ll))
+
+            # stop once the marginal log likelihood has converged
+            if self.tol is not None:
+                if i == 0 or best_loss - losses[-1] > self.tol * abs(best_loss):
+                    best_loss = min(best_loss, losses[-1])
+                    num_bad_iters = 0
+                else:
+                    num_bad_iters += 1
+                    if num_bad_iters >= self.patience:
+                        break
+        self.version += 1
+        if len(losses) > 0:
+            print('Initial LogLikelihood {:.3f} Final LogLikelihood {:.3f} Iterations {}'.format(-losses[0], -losses[-1], len(losses)))
+
+    def _load_parameters(self, params):
+        # copy learned hyperparameters (data dependent buffers such as the sample noise are not parameters)
+        with torch.no_grad():
+            for name, p in self.model.named_parameters():
+                if name in params and params[name].shape == p.shape:
+                    p.copy_(params[name])
         
     def cov_mat(self, x1, x2=None, white_noise_var=None, add_likelihood_var=False):
         # white_noise_var needs to be passed explicitly
@@ -177,7 +232,7 @@ class GPR(object):
             
             # for training data, add likelihood variance
             if add_likelihood_var:
-                cov += self.likelihood.log_noise.exp().item() * np.eye(len(cov))
+                cov += self.likelihood_var * np.eye(len(cov))
         return cov
 
     def predict(self, x, return_cov=False, return_std=False):
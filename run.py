@@ -14,13 +14,9 @@ plt.rcParams.update({'font.size': 22})
 
 
 def path_to_sample_count(env, path):
-    indices = [env.map_pose_to_gp_index_matrix[tuple(p)] for p in path]
-    is_sample = np.array(indices)!=None 
-    sample_count = np.full(len(path), 0)
-    sample_count[0] = is_sample[0]
-    for i in range(1, len(path)):
-        sample_count[i] = sample_count[i-1] + is_sample[i]
-    return sample_count
+    path = np.asarray(path)
+    is_sample = env.map_pose_to_gp_index_matrix[path[:, 0], path[:, 1]] >= 0
+    return np.cumsum(is_sample)
 
 
 def snr_test(args):
@@ -158,7 +154,8 @@ def compare_maxent(args):
     var_results = [[] for _ in range(nv)]
 
     for t in range(nsims):
-        env = FieldEnv(data_file=args.data_file, phenotype=args.phenotype, num_test=args.num_test)
+        env = FieldEnv(data_file=args.data_file, phenotype=args.phenotype, num_test=args.num_test, prune_dominated=args.prune_dominated,
+                       num_workers=args.num_workers)
         master = Agent(env, args, static_std=args.static_std)
         master.reset()
         master.pilot_survey(num_samples=initial_samples, std=master.static_std)
@@ -171,7 +168,8 @@ def compare_maxent(args):
         agents = [Agent(env, args, parent_agent=master, static_std=args.static_std, mobile_std=5*args.static_std) for _ in range(nv)]
         
         for i in range(nv):
-            res = agents[i].run_ipp(num_runs=args.num_runs, strategy='MaxEnt', disp=disp, slack=slacks[i])
+            res = agents[i].run_ipp(num_runs=args.num_runs, strategy='MaxEnt', disp=disp, slack=slacks[i], planning_budget=args.planning_budget,
+                                    branch_and_bound=args.branch_and_bound, stream_paths=args.stream_paths)
             # res = agents[i].run_ipp(num_runs=args.num_runs, strategy='MaxEnt', disp=disp, slack=0)
             res = agents[i].prediction_vs_distance(test_every=test_every, num_runs=num_naive_runs)
             error_results[i].append([zero_error] + res['error'])            
@@ -205,7 +203,8 @@ def compare_maxent(args):
     ipdb.set_trace()
 
 def run_demo(args):
-    env = FieldEnv(data_file=args.data_file, phenotype=args.phenotype, num_test=args.num_test)
+    env = FieldEnv(data_file=args.data_file, phenotype=args.phenotype, num_test=args.num_test, prune_dominated=args.prune_dominated,
+                   num_workers=args.num_workers)
     agent = Agent(env, args, static_std=args.static_std, mobile_std=10*args.static_std)
     # Reset the agent before execution
     agent.reset()
@@ -215,7 +214,8 @@ def run_demo(args):
     # Naive strategies
     # naive_strategies = ['Naive Static', 'Naive Mobile']
 
-    agent.run_ipp(render=args.render, num_runs=args.num_runs, strategy='MaxEnt')
+    agent.run_ipp(render=args.render, num_runs=args.num_runs, strategy=args.strategy, planning_budget=args.planning_budget,
+                  branch_and_bound=args.branch_and_bound, stream_paths=args.stream_paths)
     # agent.run_greedy_ipp(num_runs=args.num_runs, strategy='MaxEnt')
 
 
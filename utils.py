@@ -2,8 +2,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import torch
 import pickle 
+import heapq
+import itertools
 import pandas as pd
+from collections import OrderedDict
 import seaborn as sns
+from scipy.linalg import cho_factor, cho_solve
 import ipdb
 
 
@@ -297,7 +301,8 @@ def predictive_distribution(gp, train_x, train_y, test_x, train_var=None, test_v
     cov_xx = gp.cov_mat(x1=test_x, white_noise_var=test_var)
     cov_xa = gp.cov_mat(x1=test_x, x2=train_x)
 
-    mat1 = np.dot(cov_xa, np.linalg.inv(cov_aa))
+    # cholesky solve instead of an explicit inverse
+    mat1 = cho_solve(cho_factor(cov_aa, lower=True), cov_xa.T).T
     mu = np.dot(mat1, (train_y-train_y_mean)) + train_y_mean
     if not (return_var or return_cov or return_mi):
         return mu
@@ -373,6 +378,144 @@ def find_equi_sample_path(paths_indices, idx):
     return np.random.choice(np.where(num_samples == num_samples[idx])[0])
 
 
+def top_k(records, k, score_fn, batch_size=1024):
+    # (score, record) of the k records with the largest scores in decreasing order of score (ties keep the earlier record)
+    # records are scored in batches by score_fn (list of records -> scores), so at most k + batch_size records are
+    # held in memory and records can come from a generator of any length
+    records = iter(records)
+    # min heap of (score, -count, record)
+    best = []
+    count = 0
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if len(batch) == 0:
+            break
+        for score, record in zip(score_fn(batch), batch):
+            item = (score, -count, record)
+            count += 1
+            if len(best) < k:
+                heapq.heappush(best, item)
+            elif item[:2] > best[0][:2]:
+                heapq.heapreplace(best, item)
+    return [(score, record) for score, _, record in sorted(best, key=lambda b: b[:2], reverse=True)]
+
+
+class LRUCache(object):
+    # least recently used cache with hit/miss counters
+    # entries are evicted until there are at most max_entries and their total size (size_fn) is at most max_size
+    def __init__(self, max_entries=128, max_size=None, size_fn=len):
+        super(LRUCache, self).__init__()
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size_fn = size_fn
+        self._data = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key][0]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        size = self.size_fn(value)
+        # values larger than the cache are not stored
+        if self.max_entries == 0 or (self.max_size is not None and size > self.max_size):
+            return
+        if key in self._data:
+            self.size -= self._data.pop(key)[1]
+        self._data[key] = (value, size)
+        self.size += size
+        while len(self._data) > self.max_entries or (self.max_size is not None and self.size > self.max_size):
+            self.size -= self._data.popitem(last=False)[1][1]
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._data), 'size': self.size}
+
+
+def fused_noise_variance(static_sampled, mobile_sampled, static_std, mobile_std):
+    # variance of the fused measurement at every location (np.inf if the location hasn't been sampled)
+    precision = static_sampled / static_std**2 + mobile_sampled / mobile_std**2
+    var = np.full(len(precision), np.inf)
+    var[precision > 0] = 1.0 / precision[precision > 0]
+    return var
+
+
+class SampleStore(object):
+    # measurements of every location summarized by per sensor (static/mobile) counts and sums
+    # clones share the arrays until one of them adds a sample (copy-on-write)
+    def __init__(self, num_samples):
+        super(SampleStore, self).__init__()
+        self.static_count = np.zeros(num_samples, dtype=int)
+        self.static_sum = np.zeros(num_samples)
+        self.mobile_count = np.zeros(num_samples, dtype=int)
+        self.mobile_sum = np.zeros(num_samples)
+        self._owner = True
+
+    def clone(self):
+        other = SampleStore.__new__(SampleStore)
+        other.__dict__.update(self.__dict__)
+        self._owner = False
+        other._owner = False
+        return other
+
+    def _copy_on_write(self):
+        if not self._owner:
+            self.static_count = self.static_count.copy()
+            self.static_sum = self.static_sum.copy()
+            self.mobile_count = self.mobile_count.copy()
+            self.mobile_sum = self.mobile_sum.copy()
+            self._owner = True
+
+    def add(self, indices, y, static):
+        # static is a boolean array (True for static and False for mobile measurements)
+        self._copy_on_write()
+        indices = np.asarray(indices, dtype=int)
+        y = np.asarray(y, dtype=float)
+        static = np.asarray(static, dtype=bool)
+        np.add.at(self.static_count, indices[static], 1)
+        np.add.at(self.static_sum, indices[static], y[static])
+        np.add.at(self.mobile_count, indices[~static], 1)
+        np.add.at(self.mobile_sum, indices[~static], y[~static])
+
+    @property
+    def static_sampled(self):
+        return self.static_count > 0
+
+    @property
+    def mobile_sampled(self):
+        return self.mobile_count > 0
+
+    def get_dataset(self, static_std, mobile_std):
+        # fused measurement (precision weighted mean of the static and mobile means) of every sampled location
+        static = self.static_sampled
+        mobile = self.mobile_sampled
+        ys = np.divide(self.static_sum, self.static_count, out=np.zeros(len(static)), where=static)
+        ym = np.divide(self.mobile_sum, self.mobile_count, out=np.zeros(len(mobile)), where=mobile)
+
+        static_var = static_std**2
+        mobile_var = mobile_std**2
+        y = np.where(static & mobile, (mobile_var * ys + static_var * ym) / (mobile_var + static_var), np.where(static, ys, ym))
+        var = fused_noise_variance(static, mobile, static_std, mobile_std)
+
+        indices = np.where(static | mobile)[0]
+        return indices, y[indices], var[indices]
+
+
 # def fit_and_eval(gp, train_x, train_y, test_x, test_y, disp=False):
 #     # fit a gp model and evaluate on the training and testing dataset
 #     gp.fit(train_x, train_y, disp=disp)